@@ -1,16 +1,25 @@
-from fastapi import APIRouter, HTTPException, Depends, status
+from fastapi import APIRouter, Body, HTTPException, Depends, Response, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from typing import List
+from typing import Any, Dict, List
 from datetime import timedelta
 
 from app.core.config import settings
+from app.core.profiling import request_profiler
 from app.models.user import User, UserCreate, UserUpdate, PasswordReset
 from app.models.profile import UserProfile, UserProfileCreate, UserProfileUpdate
+from app.models.stats import AggregateStats
+from app.models.backup import SnapshotInfo
+from app.models.profiling import CaptureInfo, ProfilingConfig, ProfilingStatus
 from app.services.user_service import user_service
 from app.services.profile_service import profile_service
+from app.services.stats_service import stats_service
+from app.services.backup_service import backup_service
+from app.utils.patch import PatchValidationError, nest
 from app.utils.security import create_access_token, decode_access_token
 
-# Create main API router
+# Create main API router. Routes that write take blocking file locks
+# (held for the whole of a reshard, migration or restore), so they are
+# plain ``def`` and run on the threadpool rather than the event loop
 api_router = APIRouter()
 
 # OAuth2 scheme for token authentication
@@ -40,6 +49,16 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     return user
 
 
+async def get_current_admin_user(current_user=Depends(get_current_user)):
+    """Get current user and require them to be an admin"""
+    if current_user.mobile_phone not in settings.admin_mobile_phones:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin privileges required"
+        )
+    return current_user
+
+
 @api_router.post("/token")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     """Login endpoint - username should be mobile phone number"""
@@ -58,7 +77,7 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
 
 
 @api_router.post("/users/", response_model=User)
-async def create_user(user: UserCreate):
+def create_user(user: UserCreate):
     """Create a new user"""
     try:
         db_user = user_service.create_user(user)
@@ -110,13 +129,16 @@ async def read_user(mobile_phone: str, current_user=Depends(get_current_user)):
 
 
 @api_router.put("/users/{mobile_phone}", response_model=User)
-async def update_user(
+def update_user(
     mobile_phone: str, 
     user_update: UserUpdate, 
     current_user=Depends(get_current_user)
 ):
     """Update user"""
-    user = user_service.update_user(mobile_phone, user_update)
+    try:
+        user = user_service.update_user(mobile_phone, user_update)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     if user is None:
         raise HTTPException(status_code=404, detail="User not found")
     return User(
@@ -130,8 +152,39 @@ async def update_user(
     )
 
 
+@api_router.patch("/users/{mobile_phone}")
+def patch_user(
+    mobile_phone: str,
+    patch: Dict[str, Any] = Body(..., media_type="application/merge-patch+json"),
+    changed_only: bool = False,
+    current_user=Depends(get_current_user)
+):
+    """Partially update user with a JSON Merge Patch; with ``changed_only``
+    only the changed fields are returned"""
+    try:
+        result = user_service.patch_user(mobile_phone, patch)
+    except PatchValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if result is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    user, changes = result
+    if changed_only:
+        return changes
+    return User(
+        id=user.id,
+        mobile_phone=user.mobile_phone,
+        email=user.email,
+        name=user.name,
+        is_active=user.is_active,
+        created_at=user.created_at,
+        updated_at=user.updated_at
+    )
+
+
 @api_router.delete("/users/{mobile_phone}")
-async def delete_user(mobile_phone: str, current_user=Depends(get_current_user)):
+def delete_user(mobile_phone: str, current_user=Depends(get_current_user)):
     """Delete user"""
     success = user_service.delete_user(mobile_phone)
     if not success:
@@ -162,7 +215,7 @@ async def read_users(
 
 
 @api_router.post("/reset-password")
-async def reset_password(reset_data: PasswordReset):
+def reset_password(reset_data: PasswordReset):
     """Reset user password"""
     # Check if user exists
     if not user_service.user_exists(reset_data.mobile_phone):
@@ -191,7 +244,7 @@ async def check_user_exists(mobile_phone: str):
 
 # Profile routes
 @api_router.post("/profile/", response_model=UserProfile)
-async def create_profile(profile: UserProfileCreate, current_user=Depends(get_current_user)):
+def create_profile(profile: UserProfileCreate, current_user=Depends(get_current_user)):
     """Create a new user profile"""
     try:
         db_profile = profile_service.create_profile(current_user.id, profile)
@@ -213,7 +266,7 @@ async def get_my_profile(current_user=Depends(get_current_user)):
 
 
 @api_router.put("/profile/me", response_model=UserProfile)
-async def update_my_profile(
+def update_my_profile(
     profile_update: UserProfileUpdate,
     current_user=Depends(get_current_user)
 ):
@@ -224,10 +277,113 @@ async def update_my_profile(
     return profile
 
 
+@api_router.patch("/profile/me")
+def patch_my_profile(
+    patch: Dict[str, Any] = Body(..., media_type="application/merge-patch+json"),
+    changed_only: bool = False,
+    current_user=Depends(get_current_user)
+):
+    """Partially update current user's profile with a JSON Merge Patch; with
+    ``changed_only`` only the changed fields are returned"""
+    try:
+        result = profile_service.patch_profile(current_user.id, patch)
+    except PatchValidationError as e:
+        raise HTTPException(status_code=422, detail=e.errors)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    profile, changes = result
+    return nest(changes) if changed_only else profile
+
+
 @api_router.delete("/profile/me")
-async def delete_my_profile(current_user=Depends(get_current_user)):
+def delete_my_profile(current_user=Depends(get_current_user)):
     """Delete current user's profile"""
     success = profile_service.delete_profile(current_user.id)
     if not success:
         raise HTTPException(status_code=404, detail="Profile not found")
-    return {"message": "Profile deleted successfully"} 
\ No newline at end of file
+    return {"message": "Profile deleted successfully"} 
+
+
+# Admin routes
+@api_router.get("/admin/stats", response_model=AggregateStats)
+def get_stats(current_user=Depends(get_current_admin_user)):
+    """Get aggregate user and profile statistics"""
+    return stats_service.get_stats()
+
+
+@api_router.post("/admin/stats/rebuild", response_model=AggregateStats)
+def rebuild_stats(current_user=Depends(get_current_admin_user)):
+    """Recompute aggregate statistics from the stored records"""
+    stats_service.rebuild()
+    return stats_service.get_stats()
+
+
+# Snapshot routes are plain functions so FastAPI runs them in its threadpool
+# and other requests keep being served while a snapshot is copied
+@api_router.post("/admin/snapshots", response_model=SnapshotInfo)
+def create_snapshot(full: bool = False, current_user=Depends(get_current_admin_user)):
+    """Take a snapshot of users and profiles (incremental unless full)"""
+    return backup_service.create_snapshot(full=full)
+
+
+@api_router.get("/admin/snapshots", response_model=List[SnapshotInfo])
+def list_snapshots(current_user=Depends(get_current_admin_user)):
+    """List available snapshots, oldest first"""
+    return backup_service.list_snapshots()
+
+
+@api_router.post("/admin/snapshots/{snapshot_id}/restore", response_model=SnapshotInfo)
+def restore_snapshot(snapshot_id: str, current_user=Depends(get_current_admin_user)):
+    """Restore users and profiles to a snapshot"""
+    try:
+        snapshot = backup_service.restore_snapshot(snapshot_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    stats_service.rebuild()
+    return snapshot
+
+
+@api_router.get("/admin/profiling", response_model=ProfilingStatus)
+async def get_profiling(current_user=Depends(get_current_admin_user)):
+    """Get the current request profiling settings"""
+    return request_profiler.status()
+
+
+@api_router.put("/admin/profiling", response_model=ProfilingStatus)
+async def configure_profiling(
+    config: ProfilingConfig,
+    current_user=Depends(get_current_admin_user)
+):
+    """Profile the next requests, a route pattern, and/or slow requests"""
+    request_profiler.configure(config)
+    return request_profiler.status()
+
+
+@api_router.delete("/admin/profiling", response_model=ProfilingStatus)
+async def disable_profiling(current_user=Depends(get_current_admin_user)):
+    """Stop request profiling; existing captures are kept"""
+    request_profiler.disable()
+    return request_profiler.status()
+
+
+@api_router.get("/admin/profiling/captures", response_model=List[CaptureInfo])
+async def list_profiling_captures(current_user=Depends(get_current_admin_user)):
+    """List captured request profiles, newest first"""
+    return request_profiler.list_captures()
+
+
+@api_router.get("/admin/profiling/captures/{capture_id}")
+async def download_profiling_capture(
+    capture_id: str,
+    current_user=Depends(get_current_admin_user)
+):
+    """Download a capture as a pstats file or collapsed stacks"""
+    capture = request_profiler.get_capture(capture_id)
+    if capture is None:
+        raise HTTPException(status_code=404, detail="Capture not found")
+    extension = "prof" if capture.info.kind == "cprofile" else "collapsed.txt"
+    return Response(
+        content=capture.data,
+        media_type="application/octet-stream",
+        headers={"Content-Disposition": f'attachment; filename="{capture_id}.{extension}"'},
+    )
\ No newline at end of file
@@ -1,5 +1,5 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from typing import List, Optional
 import os
 
 
@@ -9,6 +9,22 @@ class Settings(BaseSettings):
     access_token_expire_minutes: int = 30
     cors_origins: List[str] = ["http://localhost:3000", "http://localhost:8080"]
     debug: bool = True
+    admin_mobile_phones: List[str] = []
+    # Id worker (0-1023), unique for every process writing to the same
+    # store. Unset, each process leases a free one via data_dir/worker-<n>.lock;
+    # a set id is leased too, so a second process using it fails to start.
+    worker_id: Optional[int] = None
+    # Storage layout; shard files are spread round-robin over shard_dirs
+    # (default: data_dir). Changed with scripts/reshard.py once data exists.
+    data_dir: str = "."
+    shard_dirs: List[str] = []
+    user_shard_count: int = 1
+    profile_shard_count: int = 1
+    backup_dir: str = "backups"
+    # Requests sending this value in X-Profile-Token are profiled (empty: off)
+    profiling_token: str = ""
+    profiling_buffer_size: int = 50
+    profiling_sample_interval_ms: float = 5
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,262 @@
+import cProfile
+import hmac
+import marshal
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+from typing import Deque, List, NamedTuple, Optional, Tuple
+
+from app.core.config import settings
+from app.models.profiling import CaptureInfo, ProfilingConfig, ProfilingStatus
+from app.utils.ids import generate_id
+
+PROFILE_HEADER = b"x-profile-token"
+
+
+class Capture(NamedTuple):
+    info: CaptureInfo
+    data: bytes
+
+
+class _StackSampler(threading.Thread):
+    """Background thread recording the call stacks of the process.
+
+    Stacks are only taken while at least one request is in flight and are
+    kept, with their timestamps, in a bounded buffer so the stacks seen
+    during any recent request can be pulled out afterwards. Every thread
+    is sampled, not just the event loop: handlers declared with plain
+    ``def`` run on threadpool threads. Threads parked in a wait (idle
+    pool workers) are skipped, and each stack is rooted at its thread's
+    name so the threads stay apart in a flamegraph.
+    """
+
+    def __init__(self, interval: float, history: float):
+        super().__init__(name="request-stack-sampler", daemon=True)
+        self.interval = interval
+        self.samples: Deque[Tuple[float, str]] = deque(maxlen=max(1, int(history / interval)))
+        self.in_flight = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            if not self.in_flight:
+                continue
+            now = time.perf_counter()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident or _is_idle(frame):
+                    continue
+                name = names.get(thread_id, str(thread_id))
+                self.samples.append((now, f"{name};{_collapse(frame)}"))
+
+    def stop(self):
+        self._stop_event.set()
+
+    def enter(self):
+        self.in_flight += 1
+
+    def leave(self):
+        self.in_flight -= 1
+
+    def collapsed(self, start: float, end: float) -> bytes:
+        """Samples taken between two perf_counter() times, as collapsed
+        stacks (``thread;frame;frame count`` lines)"""
+        counts = Counter(stack for when, stack in list(self.samples) if start <= when <= end)
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common()).encode()
+
+
+def _is_idle(frame) -> bool:
+    """Whether a thread is blocked waiting for work (e.g. an idle pool worker)"""
+    code = frame.f_code
+    return os.path.basename(code.co_filename) == "threading.py" and code.co_name == "wait"
+
+
+def _collapse(frame) -> str:
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class RequestProfiler:
+    """Opt-in per-request profiling and slow-request capture.
+
+    Nothing is measured until ``configure`` is called or a profiling token
+    is set: the middleware only checks ``enabled``. Once configured,
+    matching requests are profiled with cProfile (downloadable as pstats)
+    or with the stack sampler (collapsed stacks for flamegraph tools), and
+    any request slower than ``slow_threshold_ms`` has its sampled stacks
+    captured. Requests sending the profiling token in the ``X-Profile-Token``
+    header are always profiled with cProfile. Captures are kept in a ring
+    buffer of ``buffer_size`` entries.
+
+    cProfile only sees the thread the middleware runs on (the event loop),
+    so it misses the body of plain ``def`` handlers; sampling covers every
+    thread. Both also contain work done for requests running concurrently.
+    """
+
+    def __init__(self, buffer_size: int, sample_interval_ms: float, token: str = ""):
+        self.token = token
+        self.sample_interval = sample_interval_ms / 1000
+        self.captures: Deque[Capture] = deque(maxlen=buffer_size)
+        self.config: Optional[ProfilingConfig] = None
+        self.remaining: Optional[int] = None
+        self.enabled = bool(token)
+        self._pattern: Optional[re.Pattern] = None
+        self._sampler: Optional[_StackSampler] = None
+        self._cprofile_busy = False
+
+    def configure(self, config: ProfilingConfig):
+        self.disable()
+        self.config = config
+        self.remaining = config.requests if config.mode else None
+        self._pattern = re.compile(config.route_pattern) if config.route_pattern else None
+        if config.mode == "sampling" or config.slow_threshold_ms is not None:
+            # Keep enough history to cover a request several times the threshold
+            history = max(60.0, 10 * (config.slow_threshold_ms or 0) / 1000)
+            self._sampler = _StackSampler(self.sample_interval, history)
+            self._sampler.start()
+        self.enabled = True
+
+    def disable(self):
+        """Stop profiling; captures already taken are kept"""
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._sampler = None
+        self.config = None
+        self.remaining = None
+        self._pattern = None
+        self.enabled = bool(self.token)
+
+    def status(self) -> ProfilingStatus:
+        return ProfilingStatus(
+            enabled=self.config is not None,
+            config=self.config,
+            remaining_requests=self.remaining,
+            captures=len(self.captures),
+        )
+
+    def list_captures(self) -> List[CaptureInfo]:
+        """Captured profiles, newest first"""
+        return [capture.info for capture in reversed(self.captures)]
+
+    def get_capture(self, capture_id: str) -> Optional[Capture]:
+        for capture in self.captures:
+            if capture.info.id == capture_id:
+                return capture
+        return None
+
+    def _select(self, scope) -> Tuple[Optional[str], str]:
+        """Profiling mode and reason for this request, if it is to be profiled"""
+        if self.token:
+            for name, value in scope["headers"]:
+                if name == PROFILE_HEADER and hmac.compare_digest(value, self.token.encode()):
+                    if self._cprofile_busy:
+                        # Only one cProfile session can be active per thread
+                        return None, ""
+                    return "cprofile", "header"
+        config = self.config
+        if config is None or config.mode is None or self.remaining == 0:
+            return None, ""
+        if self._pattern is not None and not self._pattern.search(scope["path"]):
+            return None, ""
+        if config.mode == "cprofile" and self._cprofile_busy:
+            return None, ""
+        if self.remaining is not None:
+            self.remaining -= 1
+        return config.mode, "armed"
+
+    def _finish_budget(self):
+        """Disable once the request budget is used up and nothing else is on"""
+        config = self.config
+        if config is not None and self.remaining == 0 and config.slow_threshold_ms is None:
+            self.disable()
+
+    async def handle(self, app, scope, receive, send):
+        mode, reason = self._select(scope)
+        sampler = self._sampler
+        threshold = self.config.slow_threshold_ms if self.config is not None else None
+        response = {}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            await send(message)
+
+        profile = None
+        if mode == "cprofile":
+            self._cprofile_busy = True
+            profile = cProfile.Profile()
+        if sampler is not None:
+            sampler.enter()
+
+        started_at = datetime.utcnow()
+        start = time.perf_counter()
+        if profile is not None:
+            profile.enable()
+        try:
+            await app(scope, receive, send_wrapper)
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._cprofile_busy = False
+            end = time.perf_counter()
+            if sampler is not None:
+                sampler.leave()
+
+            duration_ms = (end - start) * 1000
+            kind, data = None, b""
+            if profile is not None:
+                profile.create_stats()
+                kind, data = "cprofile", marshal.dumps(profile.stats)
+            elif sampler is not None and (
+                mode == "sampling" or (threshold is not None and duration_ms >= threshold)
+            ):
+                if mode != "sampling":
+                    reason = "slow"
+                kind, data = "sampling", sampler.collapsed(start, end)
+
+            if kind is not None:
+                self.captures.append(Capture(
+                    info=CaptureInfo(
+                        id=generate_id(),
+                        kind=kind,
+                        reason=reason,
+                        method=scope["method"],
+                        path=scope["path"],
+                        status_code=response.get("status"),
+                        duration_ms=duration_ms,
+                        started_at=started_at,
+                        formats=["pstats"] if kind == "cprofile" else ["collapsed"],
+                    ),
+                    data=data,
+                ))
+            if reason == "armed":
+                self._finish_budget()
+
+
+request_profiler = RequestProfiler(
+    buffer_size=settings.profiling_buffer_size,
+    sample_interval_ms=settings.profiling_sample_interval_ms,
+    token=settings.profiling_token,
+)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware handing requests to the profiler when it is enabled"""
+
+    def __init__(self, app, profiler: RequestProfiler = request_profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if not self.profiler.enabled or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        await self.profiler.handle(self.app, scope, receive, send)
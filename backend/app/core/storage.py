@@ -0,0 +1,491 @@
+import fcntl
+import json
+import os
+import threading
+import zlib
+from contextlib import ExitStack, contextmanager
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple, Type
+
+from app.models.compact import RecordTable
+from app.utils.patch import set_path
+
+# A shard's delta log is folded into the shard once it grows past half the
+# shard's size (and at least this many bytes)
+DELTA_COMPACTION_MIN_BYTES = 64 * 1024
+# Lock files per field for secondary unique values (see ShardedFileStore.locked_values)
+VALUE_LOCK_BUCKETS = 64
+
+
+class ShardLayout(NamedTuple):
+    shard_count: int
+    shard_dirs: Tuple[str, ...]
+    version: int = 0
+
+
+@contextmanager
+def _file_locks(paths: List[str]) -> Iterator[None]:
+    """Hold exclusive flock()s on ``<path>.lock`` for each path, in order.
+
+    flock() conflicts between separate open()s, so this serializes threads
+    of one worker as well as separate worker processes.
+    """
+    with ExitStack() as stack:
+        for path in paths:
+            lock_file = stack.enter_context(open(path + ".lock", "a"))
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+class ShardedFileStore:
+    """JSON-list files partitioned by a CRC32 hash of each record's key.
+
+    With a single shard in ``data_dir`` the file is just ``file_name``, so an
+    unsharded store keeps its original path. Otherwise shard ``i`` of ``n``
+    is ``<stem>.<i>-of-<n><ext>`` in ``shard_dirs[i % len(shard_dirs)]``.
+    File names are unique per layout, so a re-shard never overwrites a file
+    the current layout is still using.
+
+    The layout comes from settings until ``reshard`` writes a
+    ``<stem>.layout.json`` manifest to ``data_dir``; every worker checks the
+    manifest on access and follows layout changes made while it runs.
+    Writers lock the shards they touch (``locked``) and each write replaces
+    one shard file atomically, so readers never see a partial file and
+    never need a lock.
+
+    Small field-level updates are appended to a per-shard delta log
+    (``<shard>.delta``) instead of rewriting the shard. The log's first line
+    identifies the shard file version it applies to (inode, mtime, size);
+    every rewrite replaces the shard with a new file, so a rewrite makes
+    the old log stale without extra bookkeeping, even if the process dies
+    before removing it.
+    """
+
+    def __init__(
+        self,
+        file_name: str,
+        key_field: str,
+        shard_count: int = 1,
+        shard_dirs: Optional[List[str]] = None,
+        data_dir: str = ".",
+    ):
+        self.file_name = file_name
+        self.key_field = key_field
+        self.data_dir = data_dir
+        self.stem, self.ext = os.path.splitext(file_name)
+        self.manifest_path = os.path.join(data_dir, f"{self.stem}.layout.json")
+        self._default_layout = ShardLayout(shard_count, tuple(shard_dirs or [data_dir]))
+        self._manifest_signature = None
+        self.layout = self._default_layout
+        self.refresh_layout()
+
+    def refresh_layout(self) -> bool:
+        """Reload the layout if the manifest changed; True if it did"""
+        signature = _signature(self.manifest_path)
+        if signature == self._manifest_signature:
+            return False
+        self._manifest_signature = signature
+        layout = self._default_layout
+        if signature is not None:
+            with open(self.manifest_path, "r") as f:
+                manifest = json.load(f)
+            layout = ShardLayout(
+                manifest["shard_count"], tuple(manifest["shard_dirs"]), manifest["version"]
+            )
+        changed = layout != self.layout
+        self.layout = layout
+        return changed
+
+    @property
+    def shard_count(self) -> int:
+        return self.layout.shard_count
+
+    def shard_for(self, key: str, layout: Optional[ShardLayout] = None) -> int:
+        """Shard holding the record with this key"""
+        layout = layout or self.layout
+        return zlib.crc32(key.encode()) % layout.shard_count
+
+    def shard_path(self, shard: int, layout: Optional[ShardLayout] = None) -> str:
+        layout = layout or self.layout
+        directory = layout.shard_dirs[shard % len(layout.shard_dirs)]
+        if layout.shard_count == 1:
+            return os.path.join(directory, self.file_name)
+        return os.path.join(
+            directory, f"{self.stem}.{shard:03d}-of-{layout.shard_count:03d}{self.ext}"
+        )
+
+    def shard_paths(self, layout: Optional[ShardLayout] = None) -> List[str]:
+        layout = layout or self.layout
+        return [self.shard_path(i, layout) for i in range(layout.shard_count)]
+
+    def ensure_files_exist(self):
+        """Create empty shard files for the current layout"""
+        for path in self.shard_paths():
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                with open(path, "w") as f:
+                    f.write("[]")
+
+    def signature(self, shard: int):
+        """Modification times and sizes of a shard file and its delta log"""
+        path = self.shard_path(shard)
+        return (_signature(path), _signature(path + ".delta"))
+
+    def read_shard(self, shard: int) -> List[dict]:
+        """Records of a shard with its delta log applied"""
+        return _read_shard(self.shard_path(shard), self.key_field)
+
+    def write_shard(self, shard: int, records: List[dict]):
+        """Atomically replace a shard file; call while holding its lock"""
+        path = self.shard_path(shard)
+        _write_json(path, records)
+        _remove_delta_log(path)
+
+    def write_shard_lines(self, shard: int, lines: List[str]):
+        """Like ``write_shard`` for records that are already JSON-encoded"""
+        path = self.shard_path(shard)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write("[\n" + ",\n".join(lines) + "\n]" if lines else "[]")
+        os.replace(tmp_path, path)
+        _remove_delta_log(path)
+
+    def append_delta(self, shard: int, key: str, changes: dict):
+        """Record field changes (dotted path -> value) for one record.
+
+        Call while holding the shard's lock.
+        """
+        path = self.shard_path(shard)
+        base_id = file_id(os.stat(path))
+        entry = json.dumps({"key": key, "set": changes}, default=str) + "\n"
+        if _delta_log_base(path + ".delta") == base_id:
+            with open(path + ".delta", "a") as f:
+                f.write(entry)
+        else:
+            with open(path + ".delta", "w") as f:
+                f.write(json.dumps({"base": base_id}) + "\n" + entry)
+
+    def needs_compaction(self, shard: int) -> bool:
+        """Whether a shard's delta log is big enough to fold into the shard"""
+        path = self.shard_path(shard)
+        try:
+            delta_size = os.path.getsize(path + ".delta")
+            base_size = os.path.getsize(path)
+        except FileNotFoundError:
+            return False
+        return delta_size > max(DELTA_COMPACTION_MIN_BYTES, base_size // 2)
+
+    @contextmanager
+    def locked(self, *keys: str) -> Iterator[List[int]]:
+        """Lock the shards holding ``keys`` and yield their shard numbers.
+
+        Shards are locked in ascending order so concurrent multi-shard
+        writers cannot deadlock. If the layout changes while waiting, the
+        locks are dropped and taken again on the new layout.
+        """
+        while True:
+            self.refresh_layout()
+            layout = self.layout
+            shards = [self.shard_for(key, layout) for key in keys]
+            with _file_locks([self.shard_path(i, layout) for i in sorted(set(shards))]):
+                self.refresh_layout()
+                if self.layout == layout:
+                    yield shards
+                    return
+
+    @contextmanager
+    def locked_values(self, field: str, *values: str) -> Iterator[None]:
+        """Lock secondary unique ``values`` of ``field`` (e.g. emails).
+
+        Records are sharded by their key only, so two workers could each
+        check that a value is unused in its own shard and then both claim
+        it. Holding this lock across the check and the write makes them
+        one step. Values hash into ``VALUE_LOCK_BUCKETS`` lock files in
+        ``data_dir``; take these locks before any shard lock.
+        """
+        buckets = sorted({zlib.crc32(value.encode()) % VALUE_LOCK_BUCKETS for value in values})
+        with _file_locks([
+            os.path.join(self.data_dir, f"{self.stem}.{field}-{bucket:02d}") for bucket in buckets
+        ]):
+            yield
+
+    @contextmanager
+    def locked_all(self) -> Iterator[List[str]]:
+        """Lock every shard of the current layout and yield their paths"""
+        while True:
+            self.refresh_layout()
+            layout = self.layout
+            paths = self.shard_paths(layout)
+            with _file_locks(paths):
+                self.refresh_layout()
+                if self.layout == layout:
+                    yield paths
+                    return
+
+
+def _signature(path: str):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_mtime_ns, stat.st_size)
+
+
+def file_id(stat: os.stat_result) -> List[int]:
+    """Identity of one version of a shard file, as recorded in delta logs"""
+    return [stat.st_ino, stat.st_mtime_ns, stat.st_size]
+
+
+def _read_shard(path: str, key_field: str) -> List[dict]:
+    try:
+        with open(path, "rb") as f:
+            base_id = file_id(os.fstat(f.fileno()))
+            content = f.read()
+    except FileNotFoundError:
+        return []
+    try:
+        records = json.loads(content) if content.strip() else []
+    except json.JSONDecodeError:
+        records = []
+    try:
+        with open(path + ".delta", "rb") as f:
+            delta_log = f.read()
+    except FileNotFoundError:
+        return records
+    return apply_delta_log(records, key_field, delta_log, base_id)
+
+
+def apply_delta_log(records: List[dict], key_field: str, delta_log: bytes, base_id: List[int]) -> List[dict]:
+    """Apply a delta log to the records of the shard file version ``base_id``.
+
+    A log written for an older version of the shard is ignored, as is a
+    torn last line left by a crash during an append.
+    """
+    lines = delta_log.splitlines()
+    if not lines:
+        return records
+    try:
+        if json.loads(lines[0]).get("base") != base_id:
+            return records
+    except json.JSONDecodeError:
+        return records
+    by_key = {record[key_field]: record for record in records}
+    for line in lines[1:]:
+        try:
+            entry = json.loads(line)
+        except json.JSONDecodeError:
+            break
+        record = by_key.get(entry["key"])
+        if record is not None:
+            for field_path, value in entry["set"].items():
+                set_path(record, field_path, value)
+            # Later entries refer to the record by its new key
+            by_key[record[key_field]] = record
+    return records
+
+
+def _delta_log_base(delta_path: str) -> Optional[List[int]]:
+    """Identity of the shard file version a delta log applies to"""
+    try:
+        with open(delta_path, "rb") as f:
+            return json.loads(f.readline()).get("base")
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _remove_delta_log(path: str):
+    try:
+        os.remove(path + ".delta")
+    except FileNotFoundError:
+        pass
+
+
+def _write_json(path: str, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f, indent=2, default=str)
+    os.replace(tmp_path, path)
+
+
+def reshard(store: ShardedFileStore, shard_count: int, shard_dirs: List[str]) -> int:
+    """Move every record of ``store`` to a new layout while the API runs.
+
+    Writers to the store wait on their shard lock while records are copied
+    and then retry on the new layout; readers keep serving the old files
+    until the manifest is switched. Returns the number of records moved.
+    """
+    with _file_locks([os.path.join(store.data_dir, store.stem + ".layout")]):
+        store.refresh_layout()
+        old = store.layout
+        new = ShardLayout(shard_count, tuple(shard_dirs), old.version + 1)
+        if (new.shard_count, new.shard_dirs) == (old.shard_count, old.shard_dirs):
+            return 0
+        old_paths = store.shard_paths(old)
+        with _file_locks(old_paths):
+            records = [
+                record for path in old_paths for record in _read_shard(path, store.key_field)
+            ]
+            shards: List[List[dict]] = [[] for _ in range(shard_count)]
+            for record in records:
+                shards[store.shard_for(record[store.key_field], new)].append(record)
+            for i, shard_records in enumerate(shards):
+                path = store.shard_path(i, new)
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                _write_json(path, shard_records)
+                _remove_delta_log(path)
+
+            _write_json(store.manifest_path, {
+                "shard_count": new.shard_count,
+                "shard_dirs": list(new.shard_dirs),
+                "version": new.version,
+            })
+            store.refresh_layout()
+
+            new_paths = set(store.shard_paths(new))
+            for path in old_paths:
+                if path not in new_paths and os.path.exists(path):
+                    os.remove(path)
+                    _remove_delta_log(path)
+        return len(records)
+
+
+class ShardedTables:
+    """In-memory ``RecordTable`` per shard of a ``ShardedFileStore``.
+
+    A shard's table is reloaded when its file changes on disk, so writes by
+    other workers are picked up. ``routed_fields`` are secondary unique keys
+    (e.g. email) with a global value -> shard index used to find the one
+    shard to look in.
+
+    Routes that write run on threadpool threads while reads run on the
+    event loop, so loading a table, swapping in a new layout and saving are
+    serialized by a lock. Otherwise a reader could replace a shard's table
+    with a fresh copy between a writer changing the table and saving it,
+    and the save would write the copy without the change.
+    """
+
+    def __init__(
+        self,
+        store: ShardedFileStore,
+        table_cls: Type[RecordTable],
+        routed_fields: Tuple[str, ...] = (),
+    ):
+        self.store = store
+        self.table_cls = table_cls
+        self._layout = None
+        self._tables: Dict[int, RecordTable] = {}
+        self._signatures: Dict[int, object] = {}
+        # Bumped on every load from disk, so callers can tell a table they
+        # have seen from one reloaded after another worker's write
+        self._generations: Dict[int, int] = {}
+        self._loads = 0
+        self._routes: Dict[str, Dict[str, int]] = {field: {} for field in routed_fields}
+        self._lock = threading.RLock()
+
+    def _check_layout(self):
+        with self._lock:
+            self.store.refresh_layout()
+            if self.store.layout != self._layout:
+                self._layout = self.store.layout
+                self._tables.clear()
+                self._signatures.clear()
+                for route in self._routes.values():
+                    route.clear()
+
+    def _add_routes(self, shard: int, table: RecordTable):
+        for field, route in self._routes.items():
+            for value in table.keys(field):
+                route[value] = shard
+
+    def table(self, shard: int) -> RecordTable:
+        """Table for one shard, reloaded if its file changed"""
+        with self._lock:
+            self._check_layout()
+            signature = self.store.signature(shard)
+            table = self._tables.get(shard)
+            if table is None or signature != self._signatures.get(shard):
+                table = self.table_cls(self.store.read_shard(shard))
+                self._tables[shard] = table
+                self._signatures[shard] = signature
+                self._loads += 1
+                self._generations[shard] = self._loads
+                self._add_routes(shard, table)
+            return table
+
+    def generation(self, shard: int) -> int:
+        """Load counter of a shard's table; changes when it is reloaded from
+        disk, but not on writes made through these tables"""
+        return self._generations.get(shard, 0)
+
+    def tables(self) -> List[RecordTable]:
+        """Tables for all shards, in shard order"""
+        with self._lock:
+            self._check_layout()
+            return [self.table(i) for i in range(self.store.shard_count)]
+
+    def find(self, field: str, value) -> Optional[Tuple[RecordTable, int]]:
+        """Table and row of the record whose unique ``field`` is ``value``"""
+        if field == self.store.key_field:
+            table = self.table(self.store.shard_for(value))
+            row = table.find(field, value)
+            return None if row is None else (table, row)
+
+        tables = self.tables()
+        shard = self._routes[field].get(value)
+        if shard is not None:
+            row = tables[shard].find(field, value)
+            if row is not None:
+                return tables[shard], row
+        # The route was stale (record moved or deleted); check every shard
+        for shard, table in enumerate(tables):
+            row = table.find(field, value)
+            if row is not None:
+                self._routes[field][value] = shard
+                return table, row
+        return None
+
+    def page(self, skip: int = 0, limit: int = 100) -> List[Tuple[RecordTable, int]]:
+        """(table, row) pairs for records ``skip:skip + limit`` across shards.
+
+        Records are in shard order, then insertion order within a shard.
+        Deleting a record never reorders the others, so paging stays stable;
+        a user whose mobile phone changes moves to the end of its new shard.
+        """
+        skip = max(skip, 0)
+        result = []
+        for table in self.tables():
+            if limit <= 0:
+                break
+            if skip >= len(table):
+                skip -= len(table)
+                continue
+            rows = table.rows()[skip:skip + limit]
+            result.extend((table, row) for row in rows)
+            limit -= len(rows)
+            skip = 0
+        return result
+
+    def records(self) -> List[dict]:
+        """All records of all shards as dicts"""
+        return [record for table in self.tables() for record in table.records()]
+
+    def save(self, shard: int):
+        """Write a shard's table back to its file; call while holding its lock"""
+        with self._lock:
+            table = self._tables[shard]
+            self.store.write_shard(shard, table.records())
+            self._signatures[shard] = self.store.signature(shard)
+            self._add_routes(shard, table)
+
+    def save_changes(self, shard: int, key: str, changes: dict):
+        """Persist field changes already applied to a shard's table as a
+        delta, folding the delta log into the shard once it grows large;
+        call while holding the shard's lock"""
+        with self._lock:
+            self.store.append_delta(shard, key, changes)
+            if self.store.needs_compaction(shard):
+                self.save(shard)
+            else:
+                self._signatures[shard] = self.store.signature(shard)
+                for field, route in self._routes.items():
+                    if field in changes:
+                        route[changes[field]] = shard
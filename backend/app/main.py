@@ -1,14 +1,36 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import settings
+from app.core.profiling import ProfilingMiddleware
 from app.api.routes import api_router
+from app.services.user_service import user_service
+from app.services.profile_service import profile_service
+from app.services.stats_service import stats_service
+from app.utils.ids import worker_id
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Lease this process's id worker now, so a clash stops startup
+    worker_id()
+    # Seed the aggregate counters once; services keep them current
+    # afterwards and shards changed by other workers are recounted on read
+    stats_service.attach(
+        user_service.get_user_tables(),
+        profile_service.get_profile_tables()
+    )
+    stats_service.rebuild()
+    yield
 
 
 app = FastAPI(
     title="Mind & GrowEasy Lab API",
     description="A web application backend for family memory preservation and personalized learning",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 # Set up CORS middleware
@@ -20,6 +42,9 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Opt-in request profiling; a no-op until enabled from the admin API
+app.add_middleware(ProfilingMiddleware)
+
 # Include API router
 app.include_router(api_router, prefix="/api/v1")
 
@@ -0,0 +1,17 @@
+from pydantic import BaseModel
+from typing import Dict, Optional
+from datetime import datetime
+
+
+class StoreSnapshotInfo(BaseModel):
+    records: int
+    changed: int
+    deleted: int
+
+
+class SnapshotInfo(BaseModel):
+    id: str
+    parent: Optional[str] = None
+    created_at: datetime
+    full: bool
+    stores: Dict[str, StoreSnapshotInfo]
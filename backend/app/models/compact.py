@@ -0,0 +1,302 @@
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from app.models.user import UserInDB
+from app.models.profile import UserProfile
+
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+_NO_TIMESTAMP = -(2 ** 63)
+
+# Column kinds and the array typecode each one is packed into
+_TYPECODES = {
+    'enum': 'B',      # code into a small string pool (gender, pet_type)
+    'pooled': 'I',    # code into a string pool (names, breeds, colors)
+    'bool': 'b',
+    'uint8': 'B',
+    'uint16': 'H',
+    'datetime': 'q',  # microseconds since the epoch, naive UTC
+}
+
+
+class StringPool:
+    """Stores each distinct string once and hands out integer codes for it.
+
+    Code 0 is reserved for None so optional fields need no separate flag.
+    """
+
+    def __init__(self):
+        self.values: List[Optional[str]] = [None]
+        self.codes: Dict[Optional[str], int] = {None: 0}
+
+    def code(self, value: Optional[str]) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+def _pack_datetime(value) -> int:
+    if value is None:
+        return _NO_TIMESTAMP
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _unpack_datetime(value: int) -> Optional[datetime]:
+    if value == _NO_TIMESTAMP:
+        return None
+    return _EPOCH + timedelta(microseconds=value)
+
+
+class _Column:
+    """A single field of a table, stored as a typed array or a plain list"""
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self.pool = StringPool() if kind in ('enum', 'pooled') else None
+        self.data = array(_TYPECODES[kind]) if kind in _TYPECODES else []
+
+    def encode(self, value):
+        if self.pool is not None:
+            return self.pool.code(value)
+        if self.kind == 'datetime':
+            return _pack_datetime(value)
+        if self.kind == 'bool':
+            return 1 if value else 0
+        return value
+
+    def decode(self, value):
+        if self.pool is not None:
+            return self.pool.values[value]
+        if self.kind == 'datetime':
+            return _unpack_datetime(value)
+        if self.kind == 'bool':
+            return bool(value)
+        return value
+
+    def append(self, value):
+        self.data.append(self.encode(value))
+
+    def get(self, row: int):
+        return self.decode(self.data[row])
+
+    def set(self, row: int, value):
+        self.data[row] = self.encode(value)
+
+    def keep(self, rows: Iterable[int]):
+        """Keep only the values at ``rows``, in that order"""
+        data = self.data
+        kept = (data[row] for row in rows)
+        self.data = array(data.typecode, kept) if isinstance(data, array) else list(kept)
+
+
+class RecordTable:
+    """Struct-of-arrays storage for flat or one-level nested records.
+
+    Subclasses declare ``schema`` as ``(path, kind)`` pairs where ``path`` is
+    a dotted field name (``"pet.breed"``) and ``kind`` is one of the keys of
+    ``_TYPECODES`` or ``"str"`` for unique strings kept in a plain list.
+    Nested groups listed in ``optional_groups`` are returned as None when
+    their ``presence`` field is None. ``key_fields`` get a dict index from
+    value to row. Records go in and come out as plain dicts; conversion to
+    the Pydantic models only happens in ``to_model``.
+
+    Records keep their insertion order. ``remove`` only marks a row as
+    removed; the columns are compacted once removed rows outnumber live
+    ones, so a removal is amortized O(1) and never reorders other records.
+    """
+
+    schema: Tuple[Tuple[str, str], ...] = ()
+    key_fields: Tuple[str, ...] = ()
+    optional_groups: Dict[str, str] = {}
+
+    def __init__(self, records: Iterable[dict] = ()):
+        self._columns = {path: _Column(kind) for path, kind in self.schema}
+        self._paths = [(path, path.split('.')) for path, _ in self.schema]
+        self._indexes: Dict[str, Dict[Any, int]] = {field: {} for field in self.key_fields}
+        # Rows stored, including removed ones; _live flags the rows in use
+        self._length = 0
+        self._live = array('b')
+        self._removed = 0
+        for record in records:
+            self.append(record)
+
+    def __len__(self):
+        return self._length - self._removed
+
+    def _flatten(self, record: dict) -> Dict[str, Any]:
+        flat = {}
+        for path, parts in self._paths:
+            value = record
+            for part in parts:
+                value = value.get(part) if value is not None else None
+            flat[path] = value
+        return flat
+
+    def append(self, record: dict) -> int:
+        """Add a record and return its row number"""
+        row = self._length
+        flat = self._flatten(record)
+        for path, column in self._columns.items():
+            column.append(flat[path])
+        for field, index in self._indexes.items():
+            index[flat[field]] = row
+        self._live.append(1)
+        self._length += 1
+        return row
+
+    def get(self, row: int) -> dict:
+        """Rebuild the record stored at ``row`` as a nested dict"""
+        record: Dict[str, Any] = {}
+        for path, parts in self._paths:
+            target = record
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = self._columns[path].get(row)
+        for group, presence in self.optional_groups.items():
+            if record[group][presence] is None:
+                record[group] = None
+        return record
+
+    def update(self, row: int, record: dict):
+        """Replace the record stored at ``row``"""
+        flat = self._flatten(record)
+        for field, index in self._indexes.items():
+            old = self._columns[field].get(row)
+            if index.get(old) == row:
+                del index[old]
+            index[flat[field]] = row
+        for path, column in self._columns.items():
+            column.set(row, flat[path])
+
+    def remove(self, row: int):
+        """Delete the record at ``row``. Other records keep their order, but
+        their row numbers change when the removal compacts the table"""
+        for field, index in self._indexes.items():
+            removed = self._columns[field].get(row)
+            if index.get(removed) == row:
+                del index[removed]
+        self._live[row] = 0
+        self._removed += 1
+        if self._removed * 2 > self._length:
+            self._compact()
+
+    def _compact(self):
+        """Drop removed rows from the columns and renumber the rest"""
+        rows = self.rows()
+        for column in self._columns.values():
+            column.keep(rows)
+        self._length = len(rows)
+        self._live = array('b', [1]) * self._length
+        self._removed = 0
+        for field, index in self._indexes.items():
+            column = self._columns[field]
+            index.clear()
+            for row in range(self._length):
+                index[column.get(row)] = row
+
+    def rows(self) -> Sequence[int]:
+        """Row numbers of the live records, in insertion order"""
+        if not self._removed:
+            return range(self._length)
+        return [row for row in range(self._length) if self._live[row]]
+
+    def live(self) -> Optional[array]:
+        """Per-row 1/0 flags of which rows are live, or None when every row
+        is (so typed columns can be used as they are)"""
+        return self._live if self._removed else None
+
+    def find(self, field: str, value) -> Optional[int]:
+        """Row number of the record whose key ``field`` equals ``value``"""
+        return self._indexes[field].get(value)
+
+    def keys(self, field: str) -> Iterable:
+        """All values of the key ``field`` present in the table"""
+        return self._indexes[field].keys()
+
+    def column(self, path: str) -> Tuple[Union[array, list], Optional[List[Optional[str]]]]:
+        """Stored values of one field and, for pooled fields, the strings
+        their codes refer to. Typed columns are ``array``s, so they can be
+        wrapped without copying (``np.frombuffer(data, data.typecode)``).
+        Removed rows are included until compaction; see ``live``."""
+        column = self._columns[path]
+        return column.data, column.pool.values if column.pool is not None else None
+
+    def records(self, start: int = 0, stop: Optional[int] = None) -> List[dict]:
+        """Rebuild records ``start:stop`` as nested dicts"""
+        return [self.get(row) for row in self.rows()[start:stop]]
+
+    def column_nbytes(self) -> int:
+        """Bytes held by typed arrays and list slots (not the pooled strings)"""
+        total = 0
+        for column in self._columns.values():
+            if isinstance(column.data, array):
+                total += column.data.itemsize * len(column.data)
+            else:
+                total += 8 * len(column.data)
+        return total
+
+
+class UserTable(RecordTable):
+    schema = (
+        ('id', 'str'),
+        ('mobile_phone', 'str'),
+        ('email', 'str'),
+        ('name', 'pooled'),
+        ('is_active', 'bool'),
+        ('hashed_password', 'str'),
+        ('created_at', 'datetime'),
+        ('updated_at', 'datetime'),
+    )
+    key_fields = ('mobile_phone', 'email')
+
+    def to_model(self, row: int) -> UserInDB:
+        return UserInDB(**self.get(row))
+
+
+def _person_schema(group: str, with_gender: bool = False) -> Tuple[Tuple[str, str], ...]:
+    fields = (
+        (f'{group}.first_name', 'pooled'),
+        (f'{group}.middle_name', 'pooled'),
+        (f'{group}.last_name', 'pooled'),
+    )
+    if with_gender:
+        fields += ((f'{group}.gender', 'enum'),)
+    return fields + (
+        (f'{group}.birth_year', 'uint16'),
+        (f'{group}.birth_month', 'uint8'),
+        (f'{group}.birth_day', 'uint8'),
+    )
+
+
+class ProfileTable(RecordTable):
+    schema = (
+        _person_schema('father')
+        + _person_schema('mother')
+        + _person_schema('child', with_gender=True)
+        + (
+            ('pet.name', 'pooled'),
+            ('pet.pet_type', 'enum'),
+            ('pet.breed', 'pooled'),
+            ('pet.color', 'pooled'),
+            ('user_id', 'str'),
+            ('created_at', 'datetime'),
+            ('updated_at', 'datetime'),
+        )
+    )
+    key_fields = ('user_id',)
+    optional_groups = {'pet': 'pet_type'}
+
+    def to_model(self, row: int) -> UserProfile:
+        return UserProfile(**self.get(row))
@@ -0,0 +1,50 @@
+from pydantic import BaseModel, Field, field_validator, model_validator
+from typing import List, Optional
+from datetime import datetime
+import re
+
+
+class ProfilingConfig(BaseModel):
+    # Profile matching requests with cProfile or the stack sampler
+    mode: Optional[str] = Field(None, pattern=r'^(cprofile|sampling)$')
+    # Number of matching requests to profile; None means until disabled
+    requests: Optional[int] = Field(None, ge=1)
+    # Only profile requests whose path matches this regular expression
+    route_pattern: Optional[str] = None
+    # Capture sampled stacks of any request slower than this
+    slow_threshold_ms: Optional[float] = Field(None, gt=0)
+
+    @field_validator('route_pattern')
+    @classmethod
+    def validate_route_pattern(cls, v):
+        if v is not None:
+            try:
+                re.compile(v)
+            except re.error as e:
+                raise ValueError(f'Invalid route pattern: {e}')
+        return v
+
+    @model_validator(mode='after')
+    def validate_something_enabled(self):
+        if self.mode is None and self.slow_threshold_ms is None:
+            raise ValueError('Set a profiling mode, a slow request threshold, or both')
+        return self
+
+
+class ProfilingStatus(BaseModel):
+    enabled: bool
+    config: Optional[ProfilingConfig] = None
+    remaining_requests: Optional[int] = None
+    captures: int
+
+
+class CaptureInfo(BaseModel):
+    id: str
+    kind: str
+    reason: str
+    method: str
+    path: str
+    status_code: Optional[int] = None
+    duration_ms: float
+    started_at: datetime
+    formats: List[str]
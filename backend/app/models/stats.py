@@ -0,0 +1,35 @@
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
+
+
+class UserStatusCounts(BaseModel):
+    active: int = 0
+    inactive: int = 0
+
+
+class SignupDayCount(BaseModel):
+    day: str
+    count: int
+
+
+class ChildBirthYearGenderCount(BaseModel):
+    birth_year: int
+    gender: str
+    count: int
+
+
+class PetTypeBreedCount(BaseModel):
+    pet_type: str
+    breed: str
+    count: int
+
+
+class AggregateStats(BaseModel):
+    total_users: int
+    total_profiles: int
+    users: UserStatusCounts
+    signups_per_day: List[SignupDayCount]
+    children_by_birth_year_gender: List[ChildBirthYearGenderCount]
+    pets_by_type_breed: List[PetTypeBreedCount]
+    rebuilt_at: Optional[datetime] = None
@@ -3,6 +3,8 @@ from typing import Optional
 from datetime import datetime
 import re
 
+from app.utils.ids import generate_id
+
 
 class UserBase(BaseModel):
     mobile_phone: str = Field(..., description="Mobile phone number (username)")
@@ -50,7 +52,7 @@ class UserUpdate(BaseModel):
 
 
 class UserInDB(UserBase):
-    id: str = Field(default_factory=lambda: str(datetime.utcnow().timestamp()).replace('.', ''))
+    id: str = Field(default_factory=generate_id)
     hashed_password: str
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: Optional[datetime] = None
@@ -1,111 +1,191 @@
-import json
-import os
 from datetime import datetime
-from typing import List, Optional
-from app.models.profile import UserProfile, UserProfileCreate, UserProfileUpdate
+from typing import Any, Dict, List, Optional, Tuple
+from pydantic import ValidationError
+from app.core.config import settings
+from app.core.storage import ShardedFileStore, ShardedTables
+from app.models.compact import ProfileTable
+from app.models.profile import (
+    ChildInfo, FatherInfo, MotherInfo, PetInfo, UserProfile, UserProfileCreate, UserProfileUpdate,
+)
+from app.services.stats_service import stats_service
+from app.utils.patch import PatchValidationError, prefixed_errors, validate_fields
+
+# Profile sections a patch may change, and those that may be removed with null
+PATCHABLE_SECTIONS = {'father': FatherInfo, 'mother': MotherInfo, 'child': ChildInfo, 'pet': PetInfo}
+OPTIONAL_SECTIONS = {'pet'}
 
 
 class ProfileService:
     def __init__(self, profile_file: str = "user_profile.txt"):
         self.profile_file = profile_file
+        self.store = ShardedFileStore(
+            profile_file,
+            key_field='user_id',
+            shard_count=settings.profile_shard_count,
+            shard_dirs=settings.shard_dirs,
+            data_dir=settings.data_dir,
+        )
+        self._profiles = ShardedTables(self.store, ProfileTable)
         self._ensure_file_exists()
 
     def _ensure_file_exists(self):
-        """Create the profile file if it doesn't exist."""
-        if not os.path.exists(self.profile_file):
-            with open(self.profile_file, 'w') as f:
-                json.dump([], f)
-
-    def _load_profiles(self) -> List[dict]:
-        """Load all profiles from the file."""
-        try:
-            with open(self.profile_file, 'r') as f:
-                return json.load(f)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
-
-    def _save_profiles(self, profiles: List[dict]):
-        """Save all profiles to the file."""
-        with open(self.profile_file, 'w') as f:
-            json.dump(profiles, f, indent=2, default=str)
+        """Create the profile files if they don't exist."""
+        self.store.ensure_files_exist()
 
     def create_profile(self, user_id: str, profile_data: UserProfileCreate) -> UserProfile:
         """Create a new user profile."""
-        profiles = self._load_profiles()
-        
-        # Check if profile already exists
-        for profile in profiles:
-            if profile.get('user_id') == user_id:
+        with self.store.locked(user_id) as (shard,):
+            profiles = self._profiles.table(shard)
+
+            # Check if profile already exists
+            if profiles.find('user_id', user_id) is not None:
                 raise ValueError("Profile already exists for this user")
 
-        # Create new profile
-        new_profile = UserProfile(
-            user_id=user_id,
-            father=profile_data.father,
-            mother=profile_data.mother,
-            child=profile_data.child,
-            pet=profile_data.pet,
-            created_at=datetime.now(),
-            updated_at=None
-        )
+            # Create new profile
+            new_profile = UserProfile(
+                user_id=user_id,
+                father=profile_data.father,
+                mother=profile_data.mother,
+                child=profile_data.child,
+                pet=profile_data.pet,
+                created_at=datetime.now(),
+                updated_at=None
+            )
 
-        # Convert to dict and save
-        profile_dict = new_profile.model_dump()
-        profiles.append(profile_dict)
-        self._save_profiles(profiles)
+            # Convert to dict and save
+            profile_dict = new_profile.model_dump()
+            profiles.append(profile_dict)
+            self._profiles.save(shard)
+            stats_service.profile_added(shard, profile_dict)
 
         return new_profile
 
     def get_profile_by_user_id(self, user_id: str) -> Optional[UserProfile]:
         """Get profile by user ID."""
-        profiles = self._load_profiles()
-        
-        for profile in profiles:
-            if profile.get('user_id') == user_id:
-                return UserProfile(**profile)
-        
-        return None
+        found = self._profiles.find('user_id', user_id)
+        if found is None:
+            return None
+
+        profiles, row = found
+        return profiles.to_model(row)
 
     def update_profile(self, user_id: str, profile_update: UserProfileUpdate) -> Optional[UserProfile]:
         """Update an existing user profile."""
-        profiles = self._load_profiles()
-        
-        for i, profile in enumerate(profiles):
-            if profile.get('user_id') == user_id:
-                # Update fields that are provided
-                update_data = profile_update.model_dump(exclude_unset=True)
-                
-                for field, value in update_data.items():
-                    if value is not None:
-                        profile[field] = value
-                
-                profile['updated_at'] = datetime.now().isoformat()
-                profiles[i] = profile
-                self._save_profiles(profiles)
-                
-                return UserProfile(**profile)
-        
-        return None
+        with self.store.locked(user_id) as (shard,):
+            profiles = self._profiles.table(shard)
+            row = profiles.find('user_id', user_id)
+            if row is None:
+                return None
+
+            profile = profiles.get(row)
+
+            # Update fields that are provided
+            update_data = profile_update.model_dump(exclude_unset=True)
+            before = dict(profile)
+
+            for field, value in update_data.items():
+                if value is not None:
+                    profile[field] = value
+
+            profile['updated_at'] = datetime.now()
+            profiles.update(row, profile)
+            self._profiles.save(shard)
+            stats_service.profile_changed(shard, before, profile)
+
+        return UserProfile(**profile)
+
+    def patch_profile(self, user_id: str, patch: Dict[str, Any]) -> Optional[Tuple[UserProfile, Dict[str, Any]]]:
+        """Apply a JSON Merge Patch to a profile.
+
+        Only the fields named in the patch are validated; a section the
+        profile doesn't have yet (a new pet) is validated whole. Returns the
+        updated profile and its changed fields as dotted paths, which are
+        all that is written to storage.
+        """
+        with self.store.locked(user_id) as (shard,):
+            profiles = self._profiles.table(shard)
+            row = profiles.find('user_id', user_id)
+            if row is None:
+                return None
+
+            profile = profiles.get(row)
+            changes = self._patch_changes(profile, patch)
+            if not changes:
+                return UserProfile(**profile), {}
+
+            before = dict(profile)
+            changes['updated_at'] = datetime.now()
+            for path, value in changes.items():
+                section, _, field = path.partition('.')
+                if field:
+                    profile[section] = {**profile[section], field: value}
+                else:
+                    profile[section] = value
+            profiles.update(row, profile)
+            self._profiles.save_changes(shard, user_id, changes)
+            stats_service.profile_changed(shard, before, profile)
+
+        return UserProfile(**profile), changes
+
+    def _patch_changes(self, profile: dict, patch: Dict[str, Any]) -> Dict[str, Any]:
+        """Validate a merge patch against a stored profile and return the
+        changed fields as dotted path -> value"""
+        changes = {}
+        errors = []
+        for section, value in patch.items():
+            model = PATCHABLE_SECTIONS.get(section)
+            current = profile.get(section)
+            if model is None:
+                errors.append({'type': 'extra_forbidden', 'loc': (section,), 'msg': 'Field cannot be patched'})
+            elif value is None:
+                if section not in OPTIONAL_SECTIONS:
+                    errors.append({'type': 'missing', 'loc': (section,), 'msg': 'Field cannot be removed'})
+                elif current is not None:
+                    changes[section] = None
+            elif not isinstance(value, dict):
+                errors.append({'type': 'dict_type', 'loc': (section,), 'msg': 'Input should be a valid dictionary'})
+            elif current is None:
+                # Null members of a merge patch are dropped, not stored
+                try:
+                    created = model(**{k: v for k, v in value.items() if v is not None})
+                except ValidationError as e:
+                    errors.extend(prefixed_errors(e, section))
+                else:
+                    changes[section] = created.model_dump()
+            else:
+                try:
+                    fields = validate_fields(model, current, value, section)
+                except PatchValidationError as e:
+                    errors.extend(e.errors)
+                else:
+                    changes.update((f'{section}.{field}', v) for field, v in fields.items())
+        if errors:
+            raise PatchValidationError(errors)
+        return changes
 
     def delete_profile(self, user_id: str) -> bool:
         """Delete a user profile."""
-        profiles = self._load_profiles()
-        
-        for i, profile in enumerate(profiles):
-            if profile.get('user_id') == user_id:
-                del profiles[i]
-                self._save_profiles(profiles)
-                return True
-        
-        return False
+        with self.store.locked(user_id) as (shard,):
+            profiles = self._profiles.table(shard)
+            row = profiles.find('user_id', user_id)
+            if row is None:
+                return False
+
+            profile = profiles.get(row)
+            profiles.remove(row)
+            self._profiles.save(shard)
+            stats_service.profile_removed(shard, profile)
+
+        return True
+
+    def get_profile_tables(self) -> ShardedTables:
+        """Per-shard tables of all profiles, for columnar scans."""
+        return self._profiles
 
     def get_all_profiles(self, skip: int = 0, limit: int = 100) -> List[UserProfile]:
         """Get all profiles with pagination."""
-        profiles = self._load_profiles()
-        paginated_profiles = profiles[skip:skip + limit]
-        
-        return [UserProfile(**profile) for profile in paginated_profiles]
+        return [profiles.to_model(row) for profiles, row in self._profiles.page(skip, limit)]
 
 
 # Create a global instance
-profile_service = ProfileService() 
\ No newline at end of file
+profile_service = ProfileService()
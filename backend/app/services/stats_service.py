@@ -0,0 +1,284 @@
+from collections import Counter
+from datetime import datetime
+from threading import Lock
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.storage import ShardedTables
+from app.models.compact import ProfileTable, RecordTable, UserTable
+from app.models.stats import (
+    AggregateStats,
+    ChildBirthYearGenderCount,
+    PetTypeBreedCount,
+    SignupDayCount,
+    UserStatusCounts,
+)
+
+
+_DAY_US = 86_400_000_000
+# Datetime columns hold microseconds since the epoch; None is the smallest int64
+_MISSING_DAY = np.iinfo(np.int64).min // _DAY_US
+
+
+def _signup_day(user: dict) -> str:
+    """Day bucket (YYYY-MM-DD) for a stored user's created_at value"""
+    return str(user.get('created_at'))[:10]
+
+
+def _column(table: RecordTable, path: str) -> Tuple[np.ndarray, Optional[List[Optional[str]]]]:
+    """A table column as a NumPy view (a copy without the removed rows, if
+    any are left), plus its string pool if it has one"""
+    data, pool = table.column(path)
+    values = np.frombuffer(data, dtype=data.typecode)
+    live = table.live()
+    if live is not None:
+        values = values[np.frombuffer(live, dtype=np.int8).astype(bool)]
+    return values, pool
+
+
+def _counts(keys: np.ndarray) -> Iterator[Tuple[int, int]]:
+    values, counts = np.unique(keys, return_counts=True)
+    return zip(values.tolist(), counts.tolist())
+
+
+def _user_counts(table: UserTable) -> Tuple[Counter, Counter]:
+    """Users by status and signups per day in one table"""
+    active, _ = _column(table, 'is_active')
+    n_active = int(np.count_nonzero(active))
+    by_status = Counter(active=n_active, inactive=len(table) - n_active)
+
+    created_at, _ = _column(table, 'created_at')
+    per_day = Counter()
+    for day, count in _counts(created_at // _DAY_US):
+        label = "None" if day == _MISSING_DAY else str(np.datetime64(day, 'D'))
+        per_day[label] = count
+    return by_status, per_day
+
+
+def _profile_counts(table: ProfileTable) -> Tuple[Counter, Counter]:
+    """Children by birth year and gender, and pets by type and breed, in
+    one table; pooled fields are counted by code and decoded afterwards"""
+    children = Counter()
+    years, _ = _column(table, 'child.birth_year')
+    genders, gender_pool = _column(table, 'child.gender')
+    has_gender = genders != 0
+    keys = years[has_gender].astype(np.int64) * len(gender_pool) + genders[has_gender]
+    for key, count in _counts(keys):
+        year, gender = divmod(key, len(gender_pool))
+        children[(year, gender_pool[gender])] = count
+
+    pets = Counter()
+    pet_types, type_pool = _column(table, 'pet.pet_type')
+    breeds, breed_pool = _column(table, 'pet.breed')
+    has_pet = pet_types != 0
+    keys = pet_types[has_pet].astype(np.int64) * len(breed_pool) + breeds[has_pet]
+    for key, count in _counts(keys):
+        pet_type, breed = divmod(key, len(breed_pool))
+        pets[(type_pool[pet_type], breed_pool[breed])] = count
+    return children, pets
+
+
+class ShardCounts:
+    """Aggregates over the records of one user or profile shard"""
+
+    def __init__(self):
+        self.total = 0
+        self.users_by_status = Counter()
+        self.signups_per_day = Counter()
+        self.children_by_birth_year_gender = Counter()
+        self.pets_by_type_breed = Counter()
+
+    @classmethod
+    def of_users(cls, table: UserTable) -> "ShardCounts":
+        counts = cls()
+        counts.total = len(table)
+        counts.users_by_status, counts.signups_per_day = _user_counts(table)
+        return counts
+
+    @classmethod
+    def of_profiles(cls, table: ProfileTable) -> "ShardCounts":
+        counts = cls()
+        counts.total = len(table)
+        counts.children_by_birth_year_gender, counts.pets_by_type_breed = _profile_counts(table)
+        return counts
+
+    def apply_user(self, user: dict, delta: int):
+        self.total += delta
+        status = "active" if user.get('is_active', True) else "inactive"
+        self.users_by_status[status] += delta
+        self.signups_per_day[_signup_day(user)] += delta
+
+    def apply_profile(self, profile: dict, delta: int):
+        self.total += delta
+        child = profile.get('child')
+        if child:
+            self.children_by_birth_year_gender[(child['birth_year'], child['gender'])] += delta
+        pet = profile.get('pet')
+        if pet:
+            self.pets_by_type_breed[(pet['pet_type'], pet['breed'])] += delta
+
+
+class StatsService:
+    """Aggregate counters over users and profiles, kept per shard.
+
+    The user and profile services update the counters of the shard they
+    wrote on every mutation. Shards written by another worker (or moved by
+    a re-shard) are noticed through the shard tables: reading the stats
+    checks the layout manifest and each shard's file and delta log
+    signature, and a shard whose table was reloaded from disk since it was
+    counted is recounted from its columns in one vectorized pass.
+
+    A read is therefore O(shards): three stat() calls per shard and a sum
+    over shards, with the aggregate cached until something changes. After
+    another worker writes a shard, the next read also pays O(shard size)
+    to re-parse that shard and recount it. The re-parse happens before the
+    stats lock is taken, so writers' counter updates do not wait for it,
+    and the stats routes run on the threadpool, off the event loop.
+    ``rebuild`` recounts every shard.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self._stores: Dict[str, ShardedTables] = {}
+        # store name -> shard -> (table generation counted, counts)
+        self._shards: Dict[str, Dict[int, Tuple[int, ShardCounts]]] = {"users": {}, "profiles": {}}
+        self.rebuilt_at: Optional[datetime] = None
+        self._cached: Optional[AggregateStats] = None
+
+    def attach(self, users: ShardedTables, profiles: ShardedTables):
+        """Count the records held by these shard tables"""
+        with self._lock:
+            self._stores = {"users": users, "profiles": profiles}
+            for shards in self._shards.values():
+                shards.clear()
+            self._cached = None
+
+    def _counts(self, name: str, shard: int) -> Optional[ShardCounts]:
+        entry = self._shards[name].get(shard)
+        return entry[1] if entry is not None else None
+
+    def _apply(self, name: str, shard: int, record: dict, delta: int):
+        # A shard not counted yet is counted from its table on the next read
+        counts = self._counts(name, shard)
+        if counts is not None:
+            if name == "users":
+                counts.apply_user(record, delta)
+            else:
+                counts.apply_profile(record, delta)
+            self._cached = None
+
+    def user_added(self, shard: int, user: dict):
+        """Count a user newly stored in ``shard``"""
+        with self._lock:
+            self._apply("users", shard, user, 1)
+
+    def user_removed(self, shard: int, user: dict):
+        """Uncount a user deleted from ``shard``"""
+        with self._lock:
+            self._apply("users", shard, user, -1)
+
+    def user_changed(self, shard: int, before: dict, after: dict):
+        """Move a user between buckets after an update within ``shard``"""
+        with self._lock:
+            self._apply("users", shard, before, -1)
+            self._apply("users", shard, after, 1)
+
+    def profile_added(self, shard: int, profile: dict):
+        """Count a profile newly stored in ``shard``"""
+        with self._lock:
+            self._apply("profiles", shard, profile, 1)
+
+    def profile_removed(self, shard: int, profile: dict):
+        """Uncount a profile deleted from ``shard``"""
+        with self._lock:
+            self._apply("profiles", shard, profile, -1)
+
+    def profile_changed(self, shard: int, before: dict, after: dict):
+        """Move a profile between buckets after an update within ``shard``"""
+        with self._lock:
+            self._apply("profiles", shard, before, -1)
+            self._apply("profiles", shard, after, 1)
+
+    def _load(self) -> Dict[str, List[Tuple[int, RecordTable]]]:
+        """(generation, table) per shard of each store, reloading shards
+        changed on disk; done outside the stats lock as it may parse files"""
+        loaded = {}
+        for name, tables in self._stores.items():
+            current = tables.tables()
+            loaded[name] = [(tables.generation(shard), table) for shard, table in enumerate(current)]
+        return loaded
+
+    def _sync(self, loaded: Dict[str, List[Tuple[int, RecordTable]]], force: bool = False):
+        """Recount shards whose tables were reloaded since they were counted"""
+        for name, current in loaded.items():
+            shards = self._shards[name]
+            for shard in [shard for shard in shards if shard >= len(current)]:
+                del shards[shard]
+                self._cached = None
+            for shard, (generation, table) in enumerate(current):
+                entry = shards.get(shard)
+                if force or entry is None or entry[0] != generation:
+                    if name == "users":
+                        counts = ShardCounts.of_users(table)
+                    else:
+                        counts = ShardCounts.of_profiles(table)
+                    shards[shard] = (generation, counts)
+                    self._cached = None
+
+    def rebuild(self):
+        """Recount every shard from the stored columns"""
+        loaded = self._load()
+        with self._lock:
+            self._sync(loaded, force=True)
+            self.rebuilt_at = datetime.utcnow()
+            self._cached = None
+
+    def get_stats(self) -> AggregateStats:
+        """Current aggregates across all shards"""
+        loaded = self._load()
+        with self._lock:
+            self._sync(loaded)
+            if self._cached is None:
+                users = [counts for _, counts in self._shards["users"].values()]
+                profiles = [counts for _, counts in self._shards["profiles"].values()]
+                users_by_status = _total(counts.users_by_status for counts in users)
+                self._cached = AggregateStats(
+                    total_users=sum(counts.total for counts in users),
+                    total_profiles=sum(counts.total for counts in profiles),
+                    users=UserStatusCounts(
+                        active=users_by_status["active"],
+                        inactive=users_by_status["inactive"],
+                    ),
+                    signups_per_day=[
+                        SignupDayCount(day=day, count=count)
+                        for day, count in sorted(_total(counts.signups_per_day for counts in users).items())
+                        if count
+                    ],
+                    children_by_birth_year_gender=[
+                        ChildBirthYearGenderCount(birth_year=year, gender=gender, count=count)
+                        for (year, gender), count in sorted(
+                            _total(counts.children_by_birth_year_gender for counts in profiles).items()
+                        )
+                        if count
+                    ],
+                    pets_by_type_breed=[
+                        PetTypeBreedCount(pet_type=pet_type, breed=breed, count=count)
+                        for (pet_type, breed), count in sorted(
+                            _total(counts.pets_by_type_breed for counts in profiles).items()
+                        )
+                        if count
+                    ],
+                    rebuilt_at=self.rebuilt_at,
+                )
+            return self._cached
+
+
+def _total(counters: Iterable[Counter]) -> Counter:
+    total = Counter()
+    for counter in counters:
+        total.update(counter)
+    return total
+
+
+stats_service = StatsService()
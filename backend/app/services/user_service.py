@@ -1,127 +1,224 @@
-from typing import Optional, List
-import os
-import json
+from typing import Any, Dict, Optional, List, Tuple
 from datetime import datetime
 
+from app.core.config import settings
+from app.core.storage import ShardedFileStore, ShardedTables
+from app.models.compact import UserTable
 from app.models.user import UserCreate, UserUpdate, UserInDB, PasswordReset
+from app.services.stats_service import stats_service
+from app.utils.ids import generate_id, id_timestamp
+from app.utils.patch import PatchValidationError, validate_fields
 from app.utils.security import get_password_hash, verify_password
 
+# User fields a patch may change; none of them can be removed
+PATCHABLE_FIELDS = ('mobile_phone', 'email', 'name', 'is_active')
+
 
 class UserService:
     def __init__(self):
         self.file_path = "user_details.txt"
+        self.store = ShardedFileStore(
+            self.file_path,
+            key_field='mobile_phone',
+            shard_count=settings.user_shard_count,
+            shard_dirs=settings.shard_dirs,
+            data_dir=settings.data_dir,
+        )
+        # Users are sharded by mobile phone; email lookups are routed
+        # through a global email -> shard index
+        self._users = ShardedTables(self.store, UserTable, routed_fields=('email',))
         self.ensure_file_exists()
 
     def ensure_file_exists(self):
-        """Create the user details file if it doesn't exist"""
-        if not os.path.exists(self.file_path):
-            with open(self.file_path, 'w') as f:
-                f.write("[]")
-
-    def _read_users(self) -> List[dict]:
-        """Read all users from the text file"""
-        try:
-            with open(self.file_path, 'r') as f:
-                content = f.read().strip()
-                if not content:
-                    return []
-                return json.loads(content)
-        except (FileNotFoundError, json.JSONDecodeError):
-            return []
-
-    def _write_users(self, users: List[dict]):
-        """Write all users to the text file"""
-        with open(self.file_path, 'w') as f:
-            json.dump(users, f, indent=2, default=str)
+        """Create the user details files if they don't exist"""
+        self.store.ensure_files_exist()
 
     def create_user(self, user_data: UserCreate) -> UserInDB:
         """Create a new user"""
-        users = self._read_users()
-        
         # Check if user with this mobile phone already exists
-        if any(user['mobile_phone'] == user_data.mobile_phone for user in users):
+        if self._users.find('mobile_phone', user_data.mobile_phone) is not None:
             raise ValueError("User with this mobile phone already exists")
-        
+
         # Check if user with this email already exists
-        if any(user['email'] == user_data.email for user in users):
+        if self._users.find('email', user_data.email) is not None:
             raise ValueError("User with this email already exists")
-        
-        # Hash the password
+
+        # Hash the password (before taking the shard lock; bcrypt is slow)
         hashed_password = get_password_hash(user_data.password)
-        
+
         # Create user document
         user_dict = user_data.dict()
         user_dict["hashed_password"] = hashed_password
         del user_dict["password"]
-        user_dict["created_at"] = datetime.utcnow()
+        # created_at is the time embedded in the id, so the two always agree
+        user_dict["id"] = generate_id()
+        user_dict["created_at"] = id_timestamp(user_dict["id"]).replace(tzinfo=None)
         user_dict["updated_at"] = None
-        
+
         user_doc = UserInDB(**user_dict)
-        
-        # Add to users list
-        users.append(user_doc.dict())
-        
-        # Write back to file
-        self._write_users(users)
-        
+        user_record = user_doc.dict()
+
+        # Emails are unique across shards, so lock the email as well as the shard
+        with (
+            self.store.locked_values('email', user_doc.email),
+            self.store.locked(user_doc.mobile_phone) as (shard,),
+        ):
+            users = self._users.table(shard)
+
+            # Re-check under the locks in case of a concurrent signup
+            if users.find('mobile_phone', user_doc.mobile_phone) is not None:
+                raise ValueError("User with this mobile phone already exists")
+            if self._users.find('email', user_doc.email) is not None:
+                raise ValueError("User with this email already exists")
+
+            # Add to the shard and write it back
+            users.append(user_record)
+            self._users.save(shard)
+            stats_service.user_added(shard, user_record)
+
         return user_doc
 
     def get_user_by_mobile_phone(self, mobile_phone: str) -> Optional[UserInDB]:
         """Get user by mobile phone number"""
-        users = self._read_users()
-        for user_data in users:
-            if user_data['mobile_phone'] == mobile_phone:
-                return UserInDB(**user_data)
-        return None
+        found = self._users.find('mobile_phone', mobile_phone)
+        if found is None:
+            return None
+        users, row = found
+        return users.to_model(row)
 
     def get_user_by_email(self, email: str) -> Optional[UserInDB]:
         """Get user by email"""
-        users = self._read_users()
-        for user_data in users:
-            if user_data['email'] == email:
-                return UserInDB(**user_data)
-        return None
+        found = self._users.find('email', email)
+        if found is None:
+            return None
+        users, row = found
+        return users.to_model(row)
 
     def update_user(self, mobile_phone: str, user_data: UserUpdate) -> Optional[UserInDB]:
         """Update user by mobile phone"""
-        users = self._read_users()
-        
-        for i, user in enumerate(users):
-            if user['mobile_phone'] == mobile_phone:
-                # Only update fields that are provided
-                update_data = {k: v for k, v in user_data.dict().items() if v is not None}
-                
-                if not update_data:
-                    return UserInDB(**user)
-                
-                # Update the user data
-                user.update(update_data)
-                user['updated_at'] = datetime.utcnow()
-                
-                # Write back to file
-                self._write_users(users)
-                
+        # Only update fields that are provided
+        update_data = {k: v for k, v in user_data.dict().items() if v is not None}
+        new_mobile_phone = update_data.get('mobile_phone', mobile_phone)
+        new_emails = [update_data['email']] if 'email' in update_data else []
+
+        # A new mobile phone may move the user to another shard
+        with (
+            self.store.locked_values('email', *new_emails),
+            self.store.locked(mobile_phone, new_mobile_phone) as (shard, new_shard),
+        ):
+            users = self._users.table(shard)
+            row = users.find('mobile_phone', mobile_phone)
+            if row is None:
+                return None
+
+            user = users.get(row)
+
+            if not update_data:
                 return UserInDB(**user)
-        
-        return None
+
+            self._check_unique(user, update_data)
+
+            # Update the user data
+            before = dict(user)
+            user.update(update_data)
+            user['updated_at'] = datetime.utcnow()
+
+            # Write back the affected shards
+            if new_shard == shard:
+                users.update(row, user)
+            else:
+                users.remove(row)
+                self._users.table(new_shard).append(user)
+                self._users.save(new_shard)
+            self._users.save(shard)
+            _count_user_change(shard, new_shard, before, user)
+
+        return UserInDB(**user)
+
+    def patch_user(self, mobile_phone: str, patch: Dict[str, Any]) -> Optional[Tuple[UserInDB, Dict[str, Any]]]:
+        """Apply a JSON Merge Patch to a user.
+
+        Only the fields named in the patch are validated. Returns the updated
+        user and its changed fields; unless the user moves to another shard,
+        only those fields are written to storage.
+        """
+        errors = [
+            {'type': 'extra_forbidden', 'loc': (field,), 'msg': 'Field cannot be patched'}
+            for field in patch if field not in PATCHABLE_FIELDS
+        ] + [
+            {'type': 'missing', 'loc': (field,), 'msg': 'Field cannot be removed'}
+            for field, value in patch.items() if field in PATCHABLE_FIELDS and value is None
+        ]
+        if errors:
+            raise PatchValidationError(errors)
+        update_data = validate_fields(UserUpdate, {}, patch)
+        new_mobile_phone = update_data.get('mobile_phone', mobile_phone)
+        new_emails = [update_data['email']] if 'email' in update_data else []
+
+        with (
+            self.store.locked_values('email', *new_emails),
+            self.store.locked(mobile_phone, new_mobile_phone) as (shard, new_shard),
+        ):
+            users = self._users.table(shard)
+            row = users.find('mobile_phone', mobile_phone)
+            if row is None:
+                return None
+
+            user = users.get(row)
+            changes = {k: v for k, v in update_data.items() if user.get(k) != v}
+            if not changes:
+                return UserInDB(**user), {}
+
+            self._check_unique(user, changes)
+
+            before = dict(user)
+            changes['updated_at'] = datetime.utcnow()
+            user.update(changes)
+
+            if new_shard == shard:
+                users.update(row, user)
+                self._users.save_changes(shard, mobile_phone, changes)
+            else:
+                users.remove(row)
+                self._users.table(new_shard).append(user)
+                self._users.save(new_shard)
+                self._users.save(shard)
+            _count_user_change(shard, new_shard, before, user)
+
+        return UserInDB(**user), changes
+
+    def _check_unique(self, user: dict, update_data: dict):
+        """Reject a new mobile phone or email that another user already has;
+        call while holding the shard and email locks"""
+        new_mobile_phone = update_data.get('mobile_phone', user['mobile_phone'])
+        if new_mobile_phone != user['mobile_phone'] and self._users.find('mobile_phone', new_mobile_phone) is not None:
+            raise ValueError("User with this mobile phone already exists")
+        new_email = update_data.get('email', user['email'])
+        if new_email != user['email'] and self._users.find('email', new_email) is not None:
+            raise ValueError("User with this email already exists")
 
     def delete_user(self, mobile_phone: str) -> bool:
         """Delete user by mobile phone"""
-        users = self._read_users()
-        
-        for i, user in enumerate(users):
-            if user['mobile_phone'] == mobile_phone:
-                users.pop(i)
-                self._write_users(users)
-                return True
-        
-        return False
+        with self.store.locked(mobile_phone) as (shard,):
+            users = self._users.table(shard)
+            row = users.find('mobile_phone', mobile_phone)
+            if row is None:
+                return False
+
+            user = users.get(row)
+            users.remove(row)
+            self._users.save(shard)
+            stats_service.user_removed(shard, user)
+
+        return True
+
+    def get_user_tables(self) -> ShardedTables:
+        """Per-shard tables of all users, for columnar scans"""
+        return self._users
 
     def get_all_users(self, skip: int = 0, limit: int = 100) -> List[UserInDB]:
         """Get all users with pagination"""
-        users = self._read_users()
-        paginated_users = users[skip:skip + limit]
-        return [UserInDB(**user) for user in paginated_users]
+        return [users.to_model(row) for users, row in self._users.page(skip, limit)]
 
     def authenticate_user(self, mobile_phone: str, password: str) -> Optional[UserInDB]:
         """Authenticate user with mobile phone and password"""
@@ -134,27 +231,40 @@ class UserService:
 
     def reset_password(self, reset_data: PasswordReset) -> bool:
         """Reset user password"""
-        users = self._read_users()
-        
-        for i, user in enumerate(users):
-            if user['mobile_phone'] == reset_data.mobile_phone:
-                # Hash the new password
-                hashed_password = get_password_hash(reset_data.new_password)
-                
-                # Update the password
-                user['hashed_password'] = hashed_password
-                user['updated_at'] = datetime.utcnow()
-                
-                # Write back to file
-                self._write_users(users)
-                
-                return True
-        
-        return False
+        if self._users.find('mobile_phone', reset_data.mobile_phone) is None:
+            return False
+
+        # Hash the new password
+        hashed_password = get_password_hash(reset_data.new_password)
+
+        with self.store.locked(reset_data.mobile_phone) as (shard,):
+            users = self._users.table(shard)
+            row = users.find('mobile_phone', reset_data.mobile_phone)
+            if row is None:
+                return False
+
+            # Update the password
+            user = users.get(row)
+            user['hashed_password'] = hashed_password
+            user['updated_at'] = datetime.utcnow()
+            users.update(row, user)
+
+            # Write back to file
+            self._users.save(shard)
+
+        return True
 
     def user_exists(self, mobile_phone: str) -> bool:
         """Check if user exists by mobile phone"""
         return self.get_user_by_mobile_phone(mobile_phone) is not None
 
 
-user_service = UserService() 
\ No newline at end of file
+def _count_user_change(shard: int, new_shard: int, before: dict, after: dict):
+    if new_shard == shard:
+        stats_service.user_changed(shard, before, after)
+    else:
+        stats_service.user_removed(shard, before)
+        stats_service.user_added(new_shard, after)
+
+
+user_service = UserService()
@@ -0,0 +1,160 @@
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+from typing import IO, Optional, Tuple
+import fcntl
+import os
+import time
+
+from app.core.config import settings
+
+# Snowflake-style layout of the 64-bit id, most significant bits first:
+#   42 bits  milliseconds since ID_EPOCH (good until ~2159)
+#   10 bits  worker id (0-1023), unique per process writing to the store
+#   12 bits  sequence within the millisecond (4096 ids/ms per worker)
+ID_EPOCH = datetime(2020, 1, 1, tzinfo=timezone.utc)
+_EPOCH_MS = int(ID_EPOCH.timestamp() * 1000)
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# Crockford base32; its characters are in ASCII order, so fixed-width
+# encodings sort lexicographically in the same order as the integers
+_ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+_DECODE = {c: i for i, c in enumerate(_ALPHABET)}
+ID_LENGTH = 13
+
+
+def encode_id(value: int) -> str:
+    """Encode a 64-bit integer id as a fixed-width base32 string"""
+    chars = []
+    for _ in range(ID_LENGTH):
+        value, digit = divmod(value, 32)
+        chars.append(_ALPHABET[digit])
+    return "".join(reversed(chars))
+
+
+def decode_id(user_id: str) -> int:
+    """Decode an id produced by ``encode_id``"""
+    if len(user_id) != ID_LENGTH:
+        raise ValueError(f"Not a {ID_LENGTH}-character id: {user_id!r}")
+    value = 0
+    for char in user_id:
+        try:
+            value = value * 32 + _DECODE[char]
+        except KeyError:
+            raise ValueError(f"Invalid character in id: {user_id!r}") from None
+    return value
+
+
+def is_generated_id(user_id: str) -> bool:
+    """Whether ``user_id`` uses the sortable id format"""
+    try:
+        decode_id(user_id)
+    except ValueError:
+        return False
+    return True
+
+
+def compose_id(timestamp_ms: int, worker_id: int, sequence: int) -> str:
+    """Build an id from its parts; ``timestamp_ms`` is Unix time in ms"""
+    return encode_id(
+        ((timestamp_ms - _EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS))
+        | (worker_id << SEQUENCE_BITS)
+        | sequence
+    )
+
+
+def id_timestamp_ms(user_id: str) -> int:
+    """Creation time embedded in an id, as Unix time in ms"""
+    return (decode_id(user_id) >> (WORKER_BITS + SEQUENCE_BITS)) + _EPOCH_MS
+
+
+def id_timestamp(user_id: str) -> datetime:
+    """Creation time (UTC) embedded in an id"""
+    return ID_EPOCH + timedelta(milliseconds=id_timestamp_ms(user_id) - _EPOCH_MS)
+
+
+class IdGenerator:
+    """Thread-safe generator of monotonic, lexicographically sortable ids.
+
+    Ids from one generator strictly increase. Ids from generators with
+    different worker ids never collide, so every process writing to the
+    same store needs its own ``worker_id`` (see ``lease_worker_id``).
+    """
+
+    def __init__(self, worker_id: int):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id must be between 0 and {MAX_WORKER_ID}")
+        self.worker_id = worker_id
+        self._lock = Lock()
+        self._last_ms = 0
+        self._sequence = 0
+
+    def generate(self) -> str:
+        with self._lock:
+            now_ms = time.time_ns() // 1_000_000
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            elif self._sequence < MAX_SEQUENCE:
+                # Same millisecond, or the clock moved backwards
+                self._sequence += 1
+            else:
+                # Sequence exhausted: borrow the next millisecond rather than
+                # block; the clock catches up once the burst is over
+                self._last_ms += 1
+                self._sequence = 0
+            return compose_id(self._last_ms, self.worker_id, self._sequence)
+
+
+def lease_worker_id(lease_dir: str, worker_id: Optional[int] = None) -> Tuple[int, IO]:
+    """Claim a worker id for this process with a non-blocking flock() on
+    ``<lease_dir>/worker-<n>.lock``.
+
+    Takes the lowest free id, or exactly ``worker_id`` if given. The lease
+    lasts until the returned file is closed or the process exits. Raises
+    ``RuntimeError`` if no id (or the requested one) is free.
+    """
+    candidates = range(MAX_WORKER_ID + 1) if worker_id is None else [worker_id]
+    for n in candidates:
+        lock_file = open(os.path.join(lease_dir, f"worker-{n}.lock"), "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            continue
+        return n, lock_file
+    if worker_id is None:
+        raise RuntimeError(f"All {MAX_WORKER_ID + 1} worker ids in {lease_dir} are in use")
+    raise RuntimeError(f"worker_id {worker_id} is in use by another process")
+
+
+_generator: Optional[IdGenerator] = None
+_generator_pid: Optional[int] = None
+_generator_lock = Lock()
+_lease: Optional[IO] = None
+
+
+def _process_generator() -> IdGenerator:
+    """Id generator of this process, leasing its worker id on first use.
+
+    A forked child leases again rather than sharing its parent's id.
+    """
+    global _generator, _generator_pid, _lease
+    with _generator_lock:
+        if _generator_pid != os.getpid():
+            worker_id, _lease = lease_worker_id(settings.data_dir, settings.worker_id)
+            _generator = IdGenerator(worker_id)
+            _generator_pid = os.getpid()
+        return _generator
+
+
+def worker_id() -> int:
+    """Worker id of this process (leased on first use)"""
+    return _process_generator().worker_id
+
+
+def generate_id() -> str:
+    """Generate a new user id"""
+    return _process_generator().generate()
@@ -0,0 +1,63 @@
+from typing import Any, Dict, List, Type
+
+from pydantic import BaseModel, ValidationError
+
+
+def set_path(record: dict, path: str, value: Any):
+    """Set a dotted field path (``"pet.color"``) in a nested record"""
+    parts = path.split('.')
+    target = record
+    for part in parts[:-1]:
+        if target.get(part) is None:
+            target[part] = {}
+        target = target[part]
+    target[parts[-1]] = value
+
+
+def nest(changes: Dict[str, Any]) -> dict:
+    """Turn ``{"pet.color": "Black"}`` into ``{"pet": {"color": "Black"}}``"""
+    nested: dict = {}
+    for path, value in changes.items():
+        set_path(nested, path, value)
+    return nested
+
+
+class PatchValidationError(ValueError):
+    """A patch failed validation; ``errors`` are Pydantic-style error dicts"""
+
+    def __init__(self, errors: List[dict]):
+        super().__init__("Invalid patch")
+        self.errors = errors
+
+
+def prefixed_errors(error: ValidationError, *loc) -> List[dict]:
+    """Errors of a Pydantic ValidationError with ``loc`` prepended"""
+    return [
+        {**e, "loc": (*loc, *e["loc"])}
+        for e in error.errors(include_url=False, include_context=False, include_input=False)
+    ]
+
+
+def validate_fields(model: Type[BaseModel], current: dict, patch: dict, *loc) -> Dict[str, Any]:
+    """Validate only the fields named in ``patch`` against ``model``.
+
+    Each field runs through the model's constraints and field validators
+    on its own, without revalidating the stored ``current`` values. A null
+    (JSON Merge Patch for "remove") is validated as None, so it only passes
+    for optional fields. Returns the fields whose value actually changes.
+    """
+    instance = model.model_construct(**current)
+    changes = {}
+    errors = []
+    for field, value in patch.items():
+        try:
+            model.__pydantic_validator__.validate_assignment(instance, field, value)
+        except ValidationError as e:
+            errors.extend(prefixed_errors(e, *loc))
+            continue
+        new_value = getattr(instance, field)
+        if new_value != current.get(field):
+            changes[field] = new_value
+    if errors:
+        raise PatchValidationError(errors)
+    return changes
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""Benchmark snapshot and restore throughput of the user and profile stores.
+
+Writes synthetic families into sharded stores in a temporary directory and
+times a full snapshot, an incremental snapshot after changing 1% of the
+records, an incremental snapshot with nothing changed, and a restore of
+the latest snapshot (which replays the whole chain).
+
+    python scripts/bench_snapshot.py [families] [shards]
+"""
+
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.core.storage import ShardedFileStore  # noqa: E402
+from app.services.backup_service import BackupService  # noqa: E402
+from measure_memory import make_records  # noqa: E402
+
+CHUNK = 50_000
+
+
+def write_stores(stores, families):
+    """Stream synthetic records straight into the shard files"""
+    files = {name: [open(path, "w") for path in store.shard_paths()] for name, store in stores.items()}
+    first = {name: [True] * len(handles) for name, handles in files.items()}
+    for handles in files.values():
+        for f in handles:
+            f.write("[")
+    for start in range(0, families, CHUNK):
+        users, profiles = make_records(min(CHUNK, families - start), start)
+        for name, records in (("users", users), ("profiles", profiles)):
+            store = stores[name]
+            for record in records:
+                shard = store.shard_for(record[store.key_field])
+                f = files[name][shard]
+                f.write("\n" if first[name][shard] else ",\n")
+                first[name][shard] = False
+                f.write(json.dumps(record, indent=2, default=str))
+    for handles in files.values():
+        for f in handles:
+            f.write("\n]")
+            f.close()
+
+
+def change_records(store, fraction, rng):
+    """Rewrite every shard with ``fraction`` of its records modified"""
+    with store.locked_all():
+        for shard in range(store.shard_count):
+            records = store.read_shard(shard)
+            for record in rng.sample(records, int(len(records) * fraction)):
+                record["updated_at"] = "2025-08-01 12:00:00.000000"
+            store.write_shard(shard, records)
+
+
+def timed(label, records, fn):
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    print(f"{label:28}{elapsed:8.2f} s{records / elapsed:>12,.0f} records/s")
+    return result
+
+
+def main():
+    families = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    shard_count = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    records = 2 * families
+
+    with tempfile.TemporaryDirectory() as directory:
+        stores = {
+            "users": ShardedFileStore("user_details.txt", "mobile_phone", shard_count, [directory], directory),
+            "profiles": ShardedFileStore("user_profile.txt", "user_id", shard_count, [directory], directory),
+        }
+        backups = BackupService(stores, os.path.join(directory, "backups"))
+
+        print(f"{families:,} families ({records:,} records) in {shard_count} shards per store")
+        timed("generate", records, lambda: write_stores(stores, families))
+        timed("full snapshot", records, lambda: backups.create_snapshot(full=True))
+
+        rng = random.Random(0)
+        for store in stores.values():
+            change_records(store, 0.01, rng)
+        info = timed("incremental (1% changed)", records, backups.create_snapshot)
+        print(f"{'':28}changed: {sum(s.changed for s in info.stores.values()):,}")
+        timed("incremental (no changes)", records, backups.create_snapshot)
+
+        timed("restore latest", records, lambda: backups.restore_snapshot(backups.list_snapshots()[-1].id))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Measure bytes per record for users and profiles held in memory.
+
+Compares the list-of-dicts form produced by ``json.load`` on the storage
+files with the compact column tables in ``app.models.compact``.
+
+    python scripts/measure_memory.py [families]
+"""
+
+import json
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.models.compact import ProfileTable, UserTable  # noqa: E402
+
+
+FIRST_NAMES = ["James", "Mary", "Wei", "Li", "Anna", "David", "Sofia", "Omar", "Yuki", "Liam"]
+LAST_NAMES = ["Smith", "Guo", "Huang", "Garcia", "Khan", "Tanaka", "Brown", "Nguyen", "Lee", "Silva"]
+BREEDS = ["Shiba Inu", "Labrador", "Poodle", "Siamese", "Persian", "Beagle", "Tabby"]
+COLORS = ["Brown", "Black", "White", "Grey", "Golden"]
+
+
+def _person(rng, year_range, gender=False):
+    person = {
+        "first_name": rng.choice(FIRST_NAMES),
+        "middle_name": None,
+        "last_name": rng.choice(LAST_NAMES),
+        "birth_year": rng.randint(*year_range),
+        "birth_month": rng.randint(1, 12),
+        "birth_day": rng.randint(1, 28),
+    }
+    if gender:
+        person["gender"] = rng.choice(["male", "female", "other"])
+    return person
+
+
+def make_records(families, start=0):
+    """Synthetic users and profiles, serialized like the storage files"""
+    rng = random.Random(42 + start)
+    users, profiles = [], []
+    for i in range(start, start + families):
+        user_id = str(1751870000000000 + i)
+        users.append({
+            "mobile_phone": str(5550000000 + i),
+            "email": f"user{i}@example.com",
+            "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+            "is_active": True,
+            "id": user_id,
+            "hashed_password": "$2b$12$" + "%053x" % rng.getrandbits(212),
+            "created_at": "2025-07-06 23:37:01.%06d" % rng.randint(0, 999999),
+            "updated_at": None,
+        })
+        profiles.append({
+            "father": _person(rng, (1960, 1995)),
+            "mother": _person(rng, (1960, 1995)),
+            "child": _person(rng, (2005, 2024), gender=True),
+            "pet": {
+                "name": rng.choice(FIRST_NAMES),
+                "pet_type": rng.choice(["dog", "cat"]),
+                "breed": rng.choice(BREEDS),
+                "color": rng.choice(COLORS),
+            },
+            "user_id": user_id,
+            "created_at": "2025-07-06 21:58:13.%06d" % rng.randint(0, 999999),
+            "updated_at": None,
+        })
+    return users, profiles
+
+
+def measure(build):
+    """Bytes allocated (and still alive) by ``build()``"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def main():
+    families = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    users, profiles = make_records(families)
+    users_json, profiles_json = json.dumps(users), json.dumps(profiles)
+    del users, profiles
+
+    # Tables are built from freshly parsed records so that the strings they
+    # keep are counted and the temporary dicts are not
+    _, user_dict_bytes = measure(lambda: json.loads(users_json))
+    _, profile_dict_bytes = measure(lambda: json.loads(profiles_json))
+    _, user_table_bytes = measure(lambda: UserTable(json.loads(users_json)))
+    _, profile_table_bytes = measure(lambda: ProfileTable(json.loads(profiles_json)))
+
+    print(f"{families} families")
+    print(f"{'':10}{'dicts':>14}{'compact':>14}{'ratio':>8}")
+    for label, dict_bytes, table_bytes in (
+        ("user", user_dict_bytes, user_table_bytes),
+        ("profile", profile_dict_bytes, profile_table_bytes),
+    ):
+        print(
+            f"{label:10}{dict_bytes / families:>12.0f} B{table_bytes / families:>12.0f} B"
+            f"{dict_bytes / table_bytes:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
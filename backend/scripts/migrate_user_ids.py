@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""Rewrite legacy timestamp user ids to sortable generated ids.
+
+Every user whose id is still a legacy timestamp id gets a new id
+built from its ``created_at`` time, this process's worker id and a per-
+millisecond sequence, so migrated ids sort in signup order. A user counts
+as migrated once its id is a generated id carrying its ``created_at`` to
+the millisecond (signups get such ids too), so re-running is a no-op.
+``user_id`` references in the profile store are rewritten to match, which
+moves those profiles to the shard of their new id, and the old -> new
+mapping is written to the data directory for any external references.
+
+Both stores are read and written shard by shard through their layouts
+while every shard lock of both is held, so API writers wait for it to
+finish. Run from the backend directory:
+
+    python scripts/migrate_user_ids.py [--dry-run]
+"""
+
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.core.config import settings  # noqa: E402
+from app.utils.ids import MAX_SEQUENCE, compose_id, id_timestamp_ms, is_generated_id, worker_id  # noqa: E402
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MILLISECOND = timedelta(milliseconds=1)
+
+
+def _created_at_ms(user: dict) -> Optional[int]:
+    created_at = user.get("created_at")
+    if not created_at:
+        return None
+    value = datetime.fromisoformat(str(created_at))
+    if value.tzinfo is None:
+        # Stored timestamps are naive UTC (datetime.utcnow)
+        value = value.replace(tzinfo=timezone.utc)
+    return (value - _EPOCH) // _MILLISECOND
+
+
+def is_legacy(user: dict) -> bool:
+    """Whether a user still has a legacy id (a Unix timestamp with the
+    decimal point removed).
+
+    Legacy ids can also be valid generated ids (any 13 digits are), so an
+    id only counts as generated when the time encoded in it is the user's
+    ``created_at`` to the millisecond.
+    """
+    user_id = user["id"]
+    created_at_ms = _created_at_ms(user)
+    if created_at_ms is None:
+        return user_id.isdigit()
+    return not (is_generated_id(user_id) and id_timestamp_ms(user_id) == created_at_ms)
+
+
+def build_id_map(users: list, worker_id: int) -> dict:
+    """Map each legacy user id to a new generated id.
+
+    More than ``MAX_SEQUENCE + 1`` users in one millisecond borrow the next
+    millisecond, as ``IdGenerator`` does; their ``created_at`` is moved
+    along with it so that id and ``created_at`` keep agreeing.
+    """
+    legacy = []
+    for user in users:
+        if is_legacy(user):
+            ms = _created_at_ms(user)
+            # Without created_at, use the whole seconds encoded in the legacy id
+            legacy.append((int(user["id"][:10]) * 1000 if ms is None else ms, user))
+    legacy.sort(key=lambda item: item[0])
+
+    id_map = {}
+    last_ms, sequence = None, 0
+    for ms, user in legacy:
+        if last_ms is not None and ms <= last_ms:
+            if sequence < MAX_SEQUENCE:
+                sequence += 1
+            else:
+                last_ms += 1
+                sequence = 0
+            ms = last_ms
+        else:
+            sequence = 0
+        last_ms = ms
+        if ms != _created_at_ms(user):
+            user["created_at"] = (_EPOCH + ms * _MILLISECOND).replace(tzinfo=None)
+        id_map[user["id"]] = compose_id(ms, worker_id, sequence)
+    return id_map
+
+
+def _read_shards(store, paths: list) -> tuple:
+    """Records of every shard, and each shard's original contents as JSON.
+
+    The originals are what ``read_shard`` returns, i.e. with any pending
+    delta log applied: a copy of the shard file alone would lose those
+    changes, and its delta log would not apply to the copy.
+    """
+    shards = [store.read_shard(i) for i in range(len(paths))]
+    originals = [json.dumps(records, indent=2, default=str) for records in shards]
+    return shards, originals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--map",
+        default=os.path.join(settings.data_dir, "user_id_map.json"),
+        help="where to write the old -> new id mapping",
+    )
+    parser.add_argument(
+        "--worker-id",
+        type=int,
+        help="worker id for the new ids (default: lease one, like the server)",
+    )
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    from app.services.profile_service import profile_service
+    from app.services.user_service import user_service
+
+    users_store, profiles_store = user_service.store, profile_service.store
+    # Same lock order as snapshots: users, then profiles
+    with users_store.locked_all() as user_paths, profiles_store.locked_all() as profile_paths:
+        user_shards, user_originals = _read_shards(users_store, user_paths)
+        profile_shards, profile_originals = _read_shards(profiles_store, profile_paths)
+        profiles = [profile for shard in profile_shards for profile in shard]
+        users = [user for shard in user_shards for user in shard]
+        id_map = build_id_map(users, worker_id() if args.worker_id is None else args.worker_id)
+
+        for user in users:
+            user["id"] = id_map.get(user["id"], user["id"])
+        user_ids = {user["id"] for user in users}
+        orphans = 0
+        for profile in profiles:
+            if profile["user_id"] in id_map:
+                profile["user_id"] = id_map[profile["user_id"]]
+            elif profile["user_id"] not in user_ids:
+                orphans += 1
+
+        print(f"{len(id_map)} of {len(users)} user ids to migrate")
+        if orphans:
+            print(f"warning: {orphans} profiles reference unknown user ids and were left unchanged")
+        if args.dry_run:
+            for old, new in id_map.items():
+                print(f"  {old} -> {new}")
+            return
+        if not id_map:
+            return
+
+        with open(args.map, "w") as f:
+            json.dump(id_map, f, indent=2)
+
+        # Users are sharded by mobile phone and stay put; profiles are
+        # sharded by user id and are re-bucketed under their new ids
+        profile_shards = [[] for _ in profile_paths]
+        for profile in profiles:
+            profile_shards[profiles_store.shard_for(profile["user_id"])].append(profile)
+        for store, paths, shards, originals in (
+            (users_store, user_paths, user_shards, user_originals),
+            (profiles_store, profile_paths, profile_shards, profile_originals),
+        ):
+            for shard, records in enumerate(shards):
+                with open(paths[shard] + ".bak", "w") as f:
+                    f.write(originals[shard])
+                store.write_shard(shard, records)
+    print(f"Wrote {args.map}; original shard contents kept as .bak")
+
+
+if __name__ == "__main__":
+    main()
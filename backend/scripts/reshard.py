@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Change the number or location of shards of the user or profile store.
+
+Safe to run while the API is serving: writers to the store wait for the
+copy and then continue on the new layout, which every worker picks up
+from the layout manifest.
+
+    python scripts/reshard.py users --shards 8 --dirs /mnt/a,/mnt/b
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.core.config import settings  # noqa: E402
+from app.core.storage import reshard  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("store", choices=["users", "profiles"])
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument(
+        "--dirs",
+        default=",".join(settings.shard_dirs or [settings.data_dir]),
+        help="comma-separated directories to spread the shards over",
+    )
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+
+    if args.store == "users":
+        from app.services.user_service import user_service as service
+    else:
+        from app.services.profile_service import profile_service as service
+
+    before = service.store.layout
+    moved = reshard(service.store, args.shards, args.dirs.split(","))
+    after = service.store.layout
+    print(
+        f"{args.store}: {before.shard_count} shard(s) in {list(before.shard_dirs)} -> "
+        f"{after.shard_count} shard(s) in {list(after.shard_dirs)}, {moved} records moved"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import os
+import tempfile
+
+# The services create their stores at import time; keep them, and anything
+# a test leaves behind, out of the working tree
+_data_dir = tempfile.mkdtemp(prefix="mge-test-")
+os.environ.setdefault("DATA_DIR", _data_dir)
+os.environ.setdefault("BACKUP_DIR", os.path.join(_data_dir, "backups"))
+
+import pytest  # noqa: E402
+
+from app.core.storage import ShardedFileStore, ShardedTables  # noqa: E402
+from app.models.compact import ProfileTable, UserTable  # noqa: E402
+
+
+def make_user(n: int, **fields) -> dict:
+    user = {
+        "id": f"0{n:012d}",
+        "mobile_phone": f"555{n:07d}",
+        "email": f"user{n}@example.com",
+        "name": f"User {n}",
+        "is_active": True,
+        "hashed_password": "x",
+        "created_at": "2025-07-01 12:00:00.000000",
+        "updated_at": None,
+    }
+    user.update(fields)
+    return user
+
+
+def make_profile(user_id: str, pet: bool = True, **fields) -> dict:
+    person = {"first_name": "Ann", "middle_name": None, "last_name": "Lee",
+              "birth_year": 1980, "birth_month": 5, "birth_day": 17}
+    profile = {
+        "user_id": user_id,
+        "father": dict(person, first_name="Bob"),
+        "mother": dict(person),
+        "child": dict(person, first_name="Kim", gender="female", birth_year=2015),
+        "pet": {"name": "Rex", "pet_type": "dog", "breed": "Lab", "color": "Brown"} if pet else None,
+        "created_at": "2025-07-01 12:00:00.000000",
+        "updated_at": None,
+    }
+    profile.update(fields)
+    return profile
+
+
+@pytest.fixture
+def user_store(tmp_path) -> ShardedFileStore:
+    store = ShardedFileStore("user_details.txt", "mobile_phone", 4, [str(tmp_path)], str(tmp_path))
+    store.ensure_files_exist()
+    return store
+
+
+@pytest.fixture
+def profile_store(tmp_path) -> ShardedFileStore:
+    store = ShardedFileStore("user_profile.txt", "user_id", 3, [str(tmp_path)], str(tmp_path))
+    store.ensure_files_exist()
+    return store
+
+
+@pytest.fixture
+def user_tables(user_store) -> ShardedTables:
+    return ShardedTables(user_store, UserTable, routed_fields=("email",))
+
+
+@pytest.fixture
+def profile_tables(profile_store) -> ShardedTables:
+    return ShardedTables(profile_store, ProfileTable)
+
+
+def fill(store: ShardedFileStore, records: list):
+    """Write records straight into the shards they belong to"""
+    shards = [[] for _ in range(store.shard_count)]
+    for record in records:
+        shards[store.shard_for(record[store.key_field])].append(record)
+    with store.locked_all():
+        for shard, shard_records in enumerate(shards):
+            store.write_shard(shard, shard_records)
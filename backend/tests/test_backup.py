@@ -0,0 +1,109 @@
+import pytest
+
+from app.services.backup_service import BackupService
+from conftest import fill, make_profile, make_user
+
+
+def _contents(store) -> dict:
+    return {
+        record[store.key_field]: record
+        for shard in range(store.shard_count)
+        for record in store.read_shard(shard)
+    }
+
+
+@pytest.fixture
+def backups(user_store, profile_store, tmp_path) -> BackupService:
+    return BackupService({"users": user_store, "profiles": profile_store}, str(tmp_path / "backups"))
+
+
+def _change(store, key, **fields):
+    shard = store.shard_for(key)
+    with store.locked(key):
+        records = store.read_shard(shard)
+        for record in records:
+            if record[store.key_field] == key:
+                record.update(fields)
+        store.write_shard(shard, records)
+
+
+def _delete(store, key):
+    shard = store.shard_for(key)
+    with store.locked(key):
+        store.write_shard(shard, [r for r in store.read_shard(shard) if r[store.key_field] != key])
+
+
+def test_full_snapshot_and_restore(backups, user_store, profile_store):
+    users = [make_user(n) for n in range(20)]
+    fill(user_store, users)
+    fill(profile_store, [make_profile(u["id"], pet=n % 2 == 0) for n, u in enumerate(users)])
+    before_users, before_profiles = _contents(user_store), _contents(profile_store)
+
+    info = backups.create_snapshot()
+    assert info.full
+    assert info.stores["users"].records == 20
+    assert info.stores["profiles"].changed == 20
+
+    fill(user_store, [])
+    fill(profile_store, [])
+    backups.restore_snapshot(info.id)
+
+    assert _contents(user_store) == before_users
+    assert _contents(profile_store) == before_profiles
+
+
+def test_incremental_snapshots_track_changes_and_deletes(backups, user_store, profile_store):
+    fill(user_store, [make_user(n) for n in range(20)])
+    first = backups.create_snapshot()
+    at_first = _contents(user_store)
+
+    _change(user_store, "5550000003", name="Changed")
+    _delete(user_store, "5550000004")
+    _delete(user_store, "5550000005")
+    new_key = "5550000099"
+    with user_store.locked(new_key):
+        shard = user_store.shard_for(new_key)
+        user_store.write_shard(shard, user_store.read_shard(shard) + [make_user(99)])
+    second = backups.create_snapshot()
+    at_second = _contents(user_store)
+
+    assert second.parent == first.id
+    assert not second.full
+    assert second.stores["users"].changed == 2
+    assert second.stores["users"].deleted == 2
+    assert second.stores["users"].records == 19
+
+    unchanged = backups.create_snapshot()
+    assert unchanged.stores["users"].changed == 0
+    assert unchanged.stores["users"].deleted == 0
+
+    backups.restore_snapshot(first.id)
+    assert _contents(user_store) == at_first
+    backups.restore_snapshot(unchanged.id)
+    assert _contents(user_store) == at_second
+    assert "5550000004" not in _contents(user_store)
+
+
+def test_snapshot_includes_pending_delta_logs(backups, user_store, profile_store):
+    fill(user_store, [make_user(1)])
+    shard = user_store.shard_for("5550000001")
+    user_store.append_delta(shard, "5550000001", {"name": "Patched"})
+
+    info = backups.create_snapshot()
+    user_store.append_delta(shard, "5550000001", {"name": "Later"})
+    backups.restore_snapshot(info.id)
+
+    assert _contents(user_store)["5550000001"]["name"] == "Patched"
+
+
+def test_snapshots_are_listed_in_creation_order(backups, user_store):
+    fill(user_store, [make_user(1)])
+    created = [backups.create_snapshot().id for _ in range(3)]
+    assert [s.id for s in backups.list_snapshots()] == created
+
+
+def test_unknown_snapshot_ids_are_rejected(backups):
+    with pytest.raises(ValueError):
+        backups.restore_snapshot("../../etc")
+    with pytest.raises(ValueError):
+        backups.restore_snapshot("0000000000000")
@@ -0,0 +1,110 @@
+from datetime import datetime
+
+from app.models.compact import ProfileTable, UserTable
+from app.models.profile import UserProfile
+from app.models.user import UserInDB
+from conftest import make_profile, make_user
+
+
+def test_user_round_trip():
+    users = [make_user(1), make_user(2, is_active=False, updated_at="2025-07-02 08:30:00.123456")]
+    table = UserTable(users)
+
+    assert len(table) == 2
+    first, second = table.get(0), table.get(1)
+    assert first["mobile_phone"] == "5550000001"
+    assert first["created_at"] == datetime(2025, 7, 1, 12)
+    assert first["updated_at"] is None
+    assert second["is_active"] is False
+    assert second["updated_at"] == datetime(2025, 7, 2, 8, 30, 0, 123456)
+    assert isinstance(table.to_model(1), UserInDB)
+
+
+def test_profile_round_trip_with_and_without_pet():
+    table = ProfileTable([make_profile("a"), make_profile("b", pet=False)])
+
+    with_pet, without_pet = table.get(0), table.get(1)
+    assert with_pet["pet"] == {"name": "Rex", "pet_type": "dog", "breed": "Lab", "color": "Brown"}
+    assert with_pet["father"]["middle_name"] is None
+    assert with_pet["child"]["gender"] == "female"
+    assert without_pet["pet"] is None
+    assert isinstance(table.to_model(1), UserProfile)
+    assert table.to_model(1).pet is None
+
+
+def test_update_moves_key_indexes():
+    table = UserTable([make_user(1), make_user(2)])
+
+    table.update(0, make_user(1, email="new@example.com"))
+
+    assert table.find("email", "new@example.com") == 0
+    assert table.find("email", "user1@example.com") is None
+    assert table.find("mobile_phone", "5550000002") == 1
+
+
+def test_update_can_remove_pet():
+    table = ProfileTable([make_profile("a")])
+
+    table.update(0, make_profile("a", pet=False))
+
+    assert table.get(0)["pet"] is None
+
+
+def test_remove_keeps_indexes_consistent():
+    users = [make_user(n) for n in range(10)]
+    table = UserTable(users)
+
+    for phone in ("5550000003", "5550000009", "5550000000"):
+        table.remove(table.find("mobile_phone", phone))
+
+    assert len(table) == 7
+    remaining = {user["mobile_phone"] for user in table.records()}
+    assert remaining == {user["mobile_phone"] for user in users} - {"5550000003", "5550000009", "5550000000"}
+    for phone in remaining:
+        row = table.find("mobile_phone", phone)
+        record = table.get(row)
+        assert record["mobile_phone"] == phone
+        assert table.find("email", record["email"]) == row
+    assert table.find("mobile_phone", "5550000003") is None
+    assert table.find("email", "user9@example.com") is None
+
+
+def test_remove_keeps_insertion_order_across_compaction():
+    table = UserTable([make_user(n) for n in range(10)])
+
+    for n in (2, 5, 7):
+        table.remove(table.find("mobile_phone", f"555{n:07d}"))
+    # Removed rows stay in place until they outnumber the live ones
+    assert table.live() is not None
+    assert [u["mobile_phone"][-1] for u in table.records()] == list("0134689")
+    assert [u["mobile_phone"][-1] for u in table.records(2, 4)] == list("34")
+
+    for n in (0, 8, 9):
+        table.remove(table.find("mobile_phone", f"555{n:07d}"))
+    assert table.live() is None
+    assert list(table.rows()) == [0, 1, 2, 3]
+    assert [u["mobile_phone"][-1] for u in table.records()] == list("1346")
+    for row, user in enumerate(table.records()):
+        assert table.find("mobile_phone", user["mobile_phone"]) == row
+        assert table.find("email", user["email"]) == row
+
+
+def test_remove_last_record():
+    table = UserTable([make_user(1)])
+
+    table.remove(0)
+
+    assert len(table) == 0
+    assert table.records() == []
+    assert table.find("mobile_phone", "5550000001") is None
+
+
+def test_column_exposes_codes_and_pool():
+    table = ProfileTable([make_profile("a"), make_profile("b", pet=False), make_profile("c")])
+
+    codes, pool = table.column("pet.pet_type")
+
+    assert [pool[code] for code in codes] == ["dog", None, "dog"]
+    years, pool = table.column("child.birth_year")
+    assert list(years) == [2015, 2015, 2015]
+    assert pool is None
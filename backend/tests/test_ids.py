@@ -0,0 +1,121 @@
+from datetime import datetime, timezone
+
+import pytest
+
+import app.utils.ids as ids
+from app.utils.ids import (
+    MAX_SEQUENCE, IdGenerator, compose_id, decode_id, encode_id, id_timestamp, id_timestamp_ms,
+    is_generated_id, lease_worker_id,
+)
+
+
+class FakeClock:
+    def __init__(self, ms: int):
+        self.ms = ms
+
+    def time_ns(self) -> int:
+        return self.ms * 1_000_000
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock(1_751_870_221_123)
+    monkeypatch.setattr(ids.time, "time_ns", clock.time_ns)
+    return clock
+
+
+def test_encode_decode_round_trip():
+    for value in (0, 1, 31, 32, 2 ** 40 + 7, 2 ** 64 - 1):
+        encoded = encode_id(value)
+        assert len(encoded) == 13
+        assert decode_id(encoded) == value
+
+
+def test_string_order_matches_numeric_order():
+    values = [0, 5, 31, 32, 1000, 2 ** 30, 2 ** 50 + 3, 2 ** 63]
+    assert sorted(encode_id(v) for v in values) == [encode_id(v) for v in values]
+
+
+def test_is_generated_id():
+    assert is_generated_id(compose_id(1_751_870_221_123, 1, 0))
+    assert not is_generated_id("1751870221.123")
+    assert not is_generated_id("0ABCDEFGHIJKU")  # U is not in the alphabet
+    assert not is_generated_id("175187022112")
+
+
+def test_id_timestamp_is_exact():
+    ms = 1_751_870_221_123
+    user_id = compose_id(ms, 5, 17)
+    assert id_timestamp_ms(user_id) == ms
+    assert id_timestamp(user_id) == datetime(2025, 7, 7, 6, 37, 1, 123000, tzinfo=timezone.utc)
+
+
+def test_ids_increase_within_one_millisecond(clock):
+    generator = IdGenerator(3)
+    generated = [generator.generate() for _ in range(100)]
+    assert generated == sorted(generated)
+    assert len(set(generated)) == 100
+    assert {id_timestamp_ms(i) for i in generated} == {clock.ms}
+    assert all((decode_id(i) >> 12) & 1023 == 3 for i in generated)
+
+
+def test_ids_stay_monotonic_when_the_clock_goes_backwards(clock):
+    generator = IdGenerator(0)
+    first = generator.generate()
+    clock.ms -= 5000
+    second = generator.generate()
+    clock.ms += 1000
+    third = generator.generate()
+
+    assert first < second < third
+    assert id_timestamp_ms(third) == id_timestamp_ms(first)
+
+
+def test_exhausted_sequence_borrows_the_next_millisecond(clock):
+    generator = IdGenerator(0)
+    generated = [generator.generate() for _ in range(MAX_SEQUENCE + 3)]
+
+    assert generated == sorted(generated)
+    assert len(set(generated)) == len(generated)
+    assert id_timestamp_ms(generated[MAX_SEQUENCE]) == clock.ms
+    assert id_timestamp_ms(generated[MAX_SEQUENCE + 1]) == clock.ms + 1
+    # Once the clock catches up, ids carry on after the borrowed millisecond
+    clock.ms += 1
+    assert generator.generate() > generated[-1]
+
+
+def test_generators_with_different_workers_never_collide(clock):
+    a, b = IdGenerator(1), IdGenerator(2)
+    assert not {a.generate() for _ in range(50)} & {b.generate() for _ in range(50)}
+
+
+def test_worker_id_is_bounded():
+    with pytest.raises(ValueError):
+        IdGenerator(1024)
+    with pytest.raises(ValueError):
+        IdGenerator(-1)
+
+
+def test_worker_ids_are_leased_one_per_holder(tmp_path):
+    first, first_lease = lease_worker_id(str(tmp_path))
+    second, second_lease = lease_worker_id(str(tmp_path))
+    assert (first, second) == (0, 1)
+
+    with pytest.raises(RuntimeError):
+        lease_worker_id(str(tmp_path), 1)
+
+    # A released id is free again
+    first_lease.close()
+    assert lease_worker_id(str(tmp_path))[0] == 0
+    second_lease.close()
+    assert lease_worker_id(str(tmp_path), 1)[0] == 1
+
+
+def test_process_generator_leases_its_worker_id(tmp_path, monkeypatch):
+    monkeypatch.setattr(ids.settings, "data_dir", str(tmp_path))
+    for name in ("_generator", "_generator_pid", "_lease"):
+        monkeypatch.setattr(ids, name, None)
+    _, held = lease_worker_id(str(tmp_path))
+    assert ids.worker_id() == 1
+    assert decode_id(ids.generate_id()) >> ids.SEQUENCE_BITS & ids.MAX_WORKER_ID == 1
+    held.close()
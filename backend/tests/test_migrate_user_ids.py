@@ -0,0 +1,93 @@
+import json
+import sys
+from datetime import datetime, timezone
+
+import pytest
+
+import app.services.profile_service as profile_module
+import app.services.user_service as user_module
+import migrate_user_ids
+from app.core.config import settings
+from app.services.profile_service import ProfileService
+from app.services.user_service import UserService
+from app.utils.ids import MAX_SEQUENCE, compose_id, decode_id, id_timestamp_ms
+from conftest import fill, make_profile, make_user
+
+
+def _legacy_user(n: int, created_at: str = "2025-07-07 06:37:01.123456") -> dict:
+    return make_user(n, id=str(1751870221123456 + n), created_at=created_at)
+
+
+def test_generated_ids_after_2028_are_not_legacy():
+    for year in (2028, 2029, 2089):
+        ms = int(datetime(year, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
+        user = make_user(1, id=compose_id(ms, 0, 0), created_at=f"{year}-01-01 00:00:00")
+        assert not migrate_user_ids.is_legacy(user)
+
+
+def test_thirteen_digit_legacy_ids_are_legacy():
+    assert migrate_user_ids.is_legacy(make_user(1, id="1751870221123", created_at="2025-07-07 06:37:01.123"))
+    assert migrate_user_ids.is_legacy(make_user(1, id="1751870221123", created_at=None))
+
+
+def test_build_id_map_borrows_the_next_millisecond():
+    users = [_legacy_user(n) for n in range(MAX_SEQUENCE + 10)]
+
+    id_map = migrate_user_ids.build_id_map(users, worker_id=7)
+
+    assert len(set(id_map.values())) == len(users)
+    assert all((decode_id(new) >> 12) & 1023 == 7 for new in id_map.values())
+    assert {id_timestamp_ms(new) for new in id_map.values()} == {1751870221123, 1751870221124}
+    for user in users:
+        user["id"] = id_map[user["id"]]
+    assert not any(migrate_user_ids.is_legacy(user) for user in users)
+
+
+@pytest.fixture
+def services(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "data_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "user_shard_count", 4)
+    monkeypatch.setattr(settings, "profile_shard_count", 3)
+    users, profiles = UserService(), ProfileService()
+    monkeypatch.setattr(user_module, "user_service", users)
+    monkeypatch.setattr(profile_module, "profile_service", profiles)
+    return users, profiles
+
+
+def _run(monkeypatch, tmp_path, *args):
+    monkeypatch.setattr(sys, "argv", ["migrate_user_ids.py", "--map", str(tmp_path / "map.json"), *args])
+    migrate_user_ids.main()
+
+
+def test_migration_moves_profiles_and_keeps_pending_deltas(services, monkeypatch, tmp_path):
+    users, profiles = services
+    legacy = [_legacy_user(n, created_at=f"2025-07-07 06:37:{n:02d}.000000") for n in range(30)]
+    fill(users.store, legacy)
+    fill(profiles.store, [make_profile(user["id"]) for user in legacy])
+    users.patch_user("5550000004", {"name": "Patched"})
+
+    _run(monkeypatch, tmp_path)
+
+    with open(tmp_path / "map.json") as f:
+        id_map = json.load(f)
+    assert len(id_map) == 30
+    fresh_users, fresh_profiles = UserService(), ProfileService()
+    for user in legacy:
+        migrated = fresh_users.get_user_by_mobile_phone(user["mobile_phone"])
+        assert migrated.id == id_map[user["id"]]
+        assert fresh_profiles.get_profile_by_user_id(migrated.id) is not None
+    assert fresh_users.get_user_by_mobile_phone("5550000004").name == "Patched"
+
+    # Running again finds nothing to do
+    _run(monkeypatch, tmp_path, "--map", str(tmp_path / "second.json"))
+    assert not (tmp_path / "second.json").exists()
+
+
+def test_dry_run_writes_nothing(services, monkeypatch, tmp_path):
+    users, _ = services
+    fill(users.store, [_legacy_user(1)])
+
+    _run(monkeypatch, tmp_path, "--dry-run")
+
+    assert not (tmp_path / "map.json").exists()
+    assert UserService().get_user_by_mobile_phone("5550000001").id == _legacy_user(1)["id"]
@@ -0,0 +1,226 @@
+import os
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.models.profile import PetInfo, UserProfileCreate
+from app.models.user import UserCreate, UserUpdate
+from app.services.profile_service import ProfileService
+from app.services.user_service import UserService
+from app.utils.patch import PatchValidationError, nest, set_path, validate_fields
+from conftest import make_profile
+
+
+def test_set_path_and_nest():
+    record = {"pet": None}
+    set_path(record, "pet.color", "Black")
+    set_path(record, "name", "Ann")
+    assert record == {"pet": {"color": "Black"}, "name": "Ann"}
+    assert nest({"pet.color": "Black", "updated_at": 1}) == {"pet": {"color": "Black"}, "updated_at": 1}
+
+
+def test_validate_fields_returns_only_real_changes():
+    current = {"name": "Rex", "pet_type": "dog", "breed": "Lab", "color": "Brown"}
+    assert validate_fields(PetInfo, current, {"name": "Rex", "color": "Black"}, "pet") == {"color": "Black"}
+
+
+def test_validate_fields_reports_every_bad_field():
+    current = {"name": "Rex", "pet_type": "dog", "breed": "Lab", "color": "Brown"}
+    with pytest.raises(PatchValidationError) as raised:
+        validate_fields(PetInfo, current, {"color": "Bl@ck", "pet_type": "fish", "name": None, "age": 3}, "pet")
+
+    errors = {error["loc"]: error["type"] for error in raised.value.errors}
+    assert errors == {
+        ("pet", "color"): "value_error",
+        ("pet", "pet_type"): "string_pattern_mismatch",
+        ("pet", "name"): "string_type",
+        ("pet", "age"): "no_such_attribute",
+    }
+
+
+@pytest.fixture
+def profiles(tmp_path, monkeypatch) -> ProfileService:
+    monkeypatch.setattr(settings, "data_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "profile_shard_count", 2)
+    service = ProfileService()
+    service.create_profile("u1", UserProfileCreate(**make_profile("u1", pet=False)))
+    return service
+
+
+def test_patch_profile_changes_single_fields(profiles):
+    profile, changes = profiles.patch_profile("u1", {"father": {"middle_name": "Lee"}, "child": {"birth_day": 3}})
+
+    assert profile.father.middle_name == "Lee"
+    assert profile.child.birth_day == 3
+    assert profile.father.first_name == "Bob"
+    assert set(changes) == {"father.middle_name", "child.birth_day", "updated_at"}
+    assert profiles.get_profile_by_user_id("u1").child.birth_day == 3
+
+
+def test_patch_profile_is_persisted_as_a_delta(profiles):
+    shard = profiles.store.shard_for("u1")
+    path = profiles.store.shard_path(shard)
+    with open(path) as f:
+        base = f.read()
+
+    profiles.patch_profile("u1", {"mother": {"last_name": "Kim"}})
+
+    with open(path) as f:
+        assert f.read() == base
+    with open(path + ".delta") as f:
+        assert '"mother.last_name": "Kim"' in f.read()
+    # Another worker reads base + delta
+    assert ProfileService().get_profile_by_user_id("u1").mother.last_name == "Kim"
+
+
+def test_patch_profile_adds_and_removes_the_pet(profiles):
+    pet = {"name": "Tom", "pet_type": "cat", "breed": "Siamese", "color": "Grey"}
+    profile, changes = profiles.patch_profile("u1", {"pet": pet})
+    assert profile.pet.model_dump() == pet
+    assert changes["pet"] == pet
+
+    profile, changes = profiles.patch_profile("u1", {"pet": {"color": "White"}})
+    assert profile.pet.color == "White"
+    assert profile.pet.name == "Tom"
+
+    profile, changes = profiles.patch_profile("u1", {"pet": None})
+    assert profile.pet is None
+    assert ProfileService().get_profile_by_user_id("u1").pet is None
+
+
+def test_patch_profile_without_changes_writes_nothing(profiles):
+    shard = profiles.store.shard_for("u1")
+    profile, changes = profiles.patch_profile("u1", {"father": {"first_name": "Bob"}, "pet": None})
+    assert changes == {}
+    assert not os.path.exists(profiles.store.shard_path(shard) + ".delta")
+
+
+def test_patch_profile_rejects_invalid_patches(profiles):
+    with pytest.raises(PatchValidationError) as raised:
+        profiles.patch_profile("u1", {
+            "father": None,
+            "mother": "Ann",
+            "child": {"gender": "unknown"},
+            "pet": {"name": "Tom"},
+            "user_id": "u2",
+        })
+
+    locs = {error["loc"] for error in raised.value.errors}
+    assert locs == {
+        ("father",),
+        ("mother",),
+        ("child", "gender"),
+        ("pet", "pet_type"),
+        ("pet", "breed"),
+        ("pet", "color"),
+        ("user_id",),
+    }
+    assert profiles.get_profile_by_user_id("u1").child.gender == "female"
+
+
+def test_patch_profile_of_missing_user(profiles):
+    assert profiles.patch_profile("nobody", {"pet": None}) is None
+
+
+@pytest.fixture
+def users(tmp_path, monkeypatch) -> UserService:
+    monkeypatch.setattr(settings, "data_dir", str(tmp_path))
+    monkeypatch.setattr(settings, "user_shard_count", 4)
+    service = UserService()
+    for n in (1, 2):
+        service.create_user(UserCreate(
+            mobile_phone=f"555000000{n}", email=f"user{n}@example.com", name="User", password="secret"
+        ))
+    return service
+
+
+def test_patch_user(users):
+    user, changes = users.patch_user("5550000001", {"name": "Ann", "is_active": False})
+    assert (user.name, user.is_active) == ("Ann", False)
+    assert set(changes) == {"name", "is_active", "updated_at"}
+    assert UserService().get_user_by_mobile_phone("5550000001").name == "Ann"
+
+
+def test_patch_user_email_updates_lookups(users):
+    users.patch_user("5550000001", {"email": "new@example.com"})
+    assert users.get_user_by_email("new@example.com").mobile_phone == "5550000001"
+    assert UserService().get_user_by_email("new@example.com").mobile_phone == "5550000001"
+    with pytest.raises(ValueError):
+        users.patch_user("5550000002", {"email": "new@example.com"})
+
+
+def test_patch_user_can_move_shards(users):
+    user, _ = users.patch_user("5550000001", {"mobile_phone": "5559999999"})
+    assert users.get_user_by_mobile_phone("5550000001") is None
+    assert users.get_user_by_mobile_phone("5559999999").id == user.id
+
+
+def test_patch_user_rejects_invalid_patches(users):
+    with pytest.raises(PatchValidationError) as raised:
+        users.patch_user("5550000001", {"email": None, "hashed_password": "x"})
+    assert {error["loc"] for error in raised.value.errors} == {("email",), ("hashed_password",)}
+
+    with pytest.raises(PatchValidationError) as raised:
+        users.patch_user("5550000001", {"mobile_phone": "12", "email": "not-an-email"})
+    assert {error["loc"] for error in raised.value.errors} == {("mobile_phone",), ("email",)}
+
+
+def test_update_user_rechecks_phone_and_email(users):
+    with pytest.raises(ValueError):
+        users.update_user("5550000001", UserUpdate(mobile_phone="5550000002"))
+    with pytest.raises(ValueError):
+        users.update_user("5550000001", UserUpdate(email="user2@example.com"))
+    # Unchanged values are not conflicts
+    user = users.update_user("5550000001", UserUpdate(mobile_phone="5550000001", email="user1@example.com"))
+    assert user.mobile_phone == "5550000001"
+    assert users.get_user_by_email("user2@example.com").mobile_phone == "5550000002"
+
+
+@pytest.fixture
+def client():
+    from app.main import app
+    from app.services.profile_service import profile_service
+    from app.services.user_service import user_service
+    from app.utils.security import create_access_token
+
+    if user_service.get_user_by_mobile_phone("5557770000") is None:
+        user = user_service.create_user(UserCreate(
+            mobile_phone="5557770000", email="patch@example.com", name="Patch", password="secret"
+        ))
+        profile_service.create_profile(user.id, UserProfileCreate(**make_profile(user.id)))
+    token = create_access_token({"sub": "5557770000"})
+    with TestClient(app) as client:
+        client.headers["Authorization"] = f"Bearer {token}"
+        yield client
+
+
+def test_patch_route_returns_changed_fields_only_on_request(client):
+    response = client.patch(
+        "/api/v1/profile/me?changed_only=true",
+        content='{"pet": {"color": "Black"}}',
+        headers={"Content-Type": "application/merge-patch+json"},
+    )
+    assert response.status_code == 200
+    assert response.json().keys() == {"pet", "updated_at"}
+    assert response.json()["pet"] == {"color": "Black"}
+
+    response = client.patch("/api/v1/profile/me", json={"pet": {"breed": "Pug"}})
+    assert response.status_code == 200
+    assert response.json()["pet"] == {"name": "Rex", "pet_type": "dog", "breed": "Pug", "color": "Black"}
+
+
+def test_patch_route_reports_error_locations(client):
+    response = client.patch("/api/v1/profile/me", json={"pet": {"pet_type": "fish"}, "father": {"birth_month": 13}})
+    assert response.status_code == 422
+    assert {tuple(error["loc"]) for error in response.json()["detail"]} == {
+        ("pet", "pet_type"), ("father", "birth_month"),
+    }
+
+    response = client.patch("/api/v1/users/5557770000", json={"name": None})
+    assert response.status_code == 422
+    assert response.json()["detail"][0]["loc"] == ["name"]
+
+
+def test_patch_route_for_missing_user(client):
+    assert client.patch("/api/v1/users/5550001234", json={"name": "X"}).status_code == 404
@@ -0,0 +1,133 @@
+import pstats
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.core.profiling import ProfilingMiddleware, RequestProfiler
+from app.models.profiling import ProfilingConfig
+from app.models.user import UserCreate
+
+
+def _client(profiler: RequestProfiler) -> TestClient:
+    app = FastAPI()
+    app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+    @app.get("/fast")
+    async def fast():
+        return {}
+
+    @app.get("/items/{item}")
+    async def item(item: str):
+        return {"item": item}
+
+    @app.get("/slow")
+    def slow():
+        time.sleep(0.1)
+        return {}
+
+    return TestClient(app)
+
+
+@pytest.fixture
+def profiler():
+    profiler = RequestProfiler(buffer_size=10, sample_interval_ms=1)
+    yield profiler
+    profiler.disable()
+
+
+def test_disabled_profiler_passes_requests_through(profiler, monkeypatch):
+    async def fail(*args):
+        raise AssertionError("profiler should not be called")
+
+    monkeypatch.setattr(profiler, "handle", fail)
+    assert _client(profiler).get("/fast").status_code == 200
+    assert not profiler.captures
+
+
+def test_request_budget_disables_profiling_when_used_up(profiler):
+    profiler.configure(ProfilingConfig(mode="cprofile", requests=2))
+    client = _client(profiler)
+    for _ in range(3):
+        client.get("/fast")
+
+    assert [(c.kind, c.reason) for c in profiler.list_captures()] == [("cprofile", "armed")] * 2
+    assert not profiler.enabled
+    assert profiler.status().enabled is False
+
+
+def test_route_pattern_limits_what_is_profiled(profiler):
+    profiler.configure(ProfilingConfig(mode="cprofile", requests=5, route_pattern="^/items/"))
+    client = _client(profiler)
+    client.get("/fast")
+    client.get("/items/1")
+
+    assert [c.path for c in profiler.list_captures()] == ["/items/1"]
+    # Only matching requests count against the budget
+    assert profiler.status().remaining_requests == 4
+
+
+def test_profile_token_header_profiles_single_requests():
+    profiler = RequestProfiler(buffer_size=10, sample_interval_ms=1, token="secret")
+    client = _client(profiler)
+    client.get("/fast")
+    client.get("/fast", headers={"X-Profile-Token": "wrong"})
+    client.get("/fast", headers={"X-Profile-Token": "secret"})
+
+    captures = profiler.list_captures()
+    assert [(c.kind, c.reason, c.status_code) for c in captures] == [("cprofile", "header", 200)]
+    # The token alone does not switch on armed profiling
+    assert profiler.status().enabled is False
+
+
+def test_slow_requests_are_captured_into_the_ring_buffer():
+    profiler = RequestProfiler(buffer_size=2, sample_interval_ms=1)
+    profiler.configure(ProfilingConfig(slow_threshold_ms=50))
+    client = _client(profiler)
+    try:
+        client.get("/fast")
+        for _ in range(3):
+            client.get("/slow")
+    finally:
+        profiler.disable()
+
+    captures = list(profiler.captures)
+    assert len(captures) == 2
+    for capture in captures:
+        assert (capture.info.kind, capture.info.reason, capture.info.path) == ("sampling", "slow", "/slow")
+        assert capture.info.duration_ms >= 50
+        # Collapsed stacks of the threadpool thread running the handler
+        assert b":slow" in capture.data
+
+
+def test_cprofile_capture_downloads_as_pstats(tmp_path, monkeypatch):
+    from app.core.profiling import request_profiler
+    from app.main import app
+    from app.services.user_service import user_service
+    from app.utils.security import create_access_token
+
+    if user_service.get_user_by_mobile_phone("5558880000") is None:
+        user_service.create_user(UserCreate(
+            mobile_phone="5558880000", email="profiler@example.com", name="Admin", password="secret"
+        ))
+    monkeypatch.setattr(settings, "admin_mobile_phones", ["5558880000"])
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': '5558880000'})}"}
+
+    with TestClient(app) as client:
+        try:
+            response = client.put("/api/v1/admin/profiling", json={"mode": "cprofile", "requests": 1}, headers=headers)
+            assert response.json()["remaining_requests"] == 1
+            client.get("/health")
+        finally:
+            request_profiler.disable()
+
+        capture = client.get("/api/v1/admin/profiling/captures", headers=headers).json()[0]
+        assert capture["path"] == "/health"
+        response = client.get(f"/api/v1/admin/profiling/captures/{capture['id']}", headers=headers)
+
+    assert response.headers["content-disposition"].endswith('.prof"')
+    path = tmp_path / "capture.prof"
+    path.write_bytes(response.content)
+    assert pstats.Stats(str(path)).total_calls > 0
@@ -0,0 +1,78 @@
+from app.core.storage import ShardedTables
+from app.models.compact import ProfileTable, UserTable
+from app.services.stats_service import ShardCounts, StatsService
+from conftest import fill, make_profile, make_user
+
+
+def _stats(user_tables, profile_tables) -> StatsService:
+    stats = StatsService()
+    stats.attach(user_tables, profile_tables)
+    stats.rebuild()
+    return stats
+
+
+def test_rebuild_counts_from_columns(user_tables, profile_tables, user_store, profile_store):
+    users = [make_user(n, is_active=n % 3 != 0, created_at=f"2025-07-0{1 + n % 2} 12:00:00") for n in range(12)]
+    fill(user_store, users)
+    fill(profile_store, [make_profile(u["id"], pet=n < 5) for n, u in enumerate(users)])
+
+    stats = _stats(user_tables, profile_tables).get_stats()
+
+    assert stats.total_users == 12
+    assert stats.total_profiles == 12
+    assert (stats.users.active, stats.users.inactive) == (8, 4)
+    assert [(d.day, d.count) for d in stats.signups_per_day] == [("2025-07-01", 6), ("2025-07-02", 6)]
+    assert [(c.birth_year, c.gender, c.count) for c in stats.children_by_birth_year_gender] == [(2015, "female", 12)]
+    assert [(p.pet_type, p.breed, p.count) for p in stats.pets_by_type_breed] == [("dog", "Lab", 5)]
+
+
+def test_counts_skip_removed_rows():
+    table = UserTable([make_user(n, is_active=n % 2 == 0) for n in range(6)])
+    table.remove(table.find("mobile_phone", "5550000000"))
+    assert table.live() is not None
+
+    counts = ShardCounts.of_users(table)
+
+    assert counts.total == 5
+    assert counts.users_by_status == {"active": 2, "inactive": 3}
+    assert sum(counts.signups_per_day.values()) == 5
+
+
+def test_mutations_update_their_shard(user_tables, profile_tables, user_store):
+    fill(user_store, [make_user(1)])
+    stats = _stats(user_tables, profile_tables)
+    user = make_user(2, is_active=False)
+    shard = user_store.shard_for(user["mobile_phone"])
+
+    user_tables.table(shard).append(user)
+    with user_store.locked(user["mobile_phone"]):
+        user_tables.save(shard)
+    stats.user_added(shard, user)
+
+    result = stats.get_stats()
+    assert result.total_users == 2
+    assert result.users.inactive == 1
+
+
+def test_writes_by_another_worker_are_counted(user_tables, profile_tables, user_store, profile_store):
+    fill(user_store, [make_user(1)])
+    stats = _stats(user_tables, profile_tables)
+    assert stats.get_stats().total_users == 1
+
+    other_worker = ShardedTables(user_store, UserTable, routed_fields=("email",))
+    user = make_user(2)
+    shard = user_store.shard_for(user["mobile_phone"])
+    other_worker.table(shard).append(user)
+    with user_store.locked(user["mobile_phone"]):
+        other_worker.save(shard)
+    other_profiles = ShardedTables(profile_store, ProfileTable)
+    profile = make_profile(user["id"])
+    profile_shard = profile_store.shard_for(user["id"])
+    other_profiles.table(profile_shard).append(profile)
+    with profile_store.locked(user["id"]):
+        other_profiles.save(profile_shard)
+
+    result = stats.get_stats()
+    assert result.total_users == 2
+    assert result.total_profiles == 1
+    assert [(p.pet_type, p.count) for p in result.pets_by_type_breed] == [("dog", 1)]
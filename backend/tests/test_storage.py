@@ -0,0 +1,277 @@
+import json
+import os
+import threading
+import time
+
+from app.core.storage import (
+    DELTA_COMPACTION_MIN_BYTES, ShardedFileStore, ShardedTables, apply_delta_log, file_id, reshard,
+)
+from app.models.compact import UserTable
+from conftest import fill, make_profile, make_user
+
+
+def _shard_of(store, key):
+    shard = store.shard_for(key)
+    return shard, store.shard_path(shard)
+
+
+def test_single_shard_keeps_original_file_name(tmp_path):
+    store = ShardedFileStore("user_details.txt", "mobile_phone", 1, [str(tmp_path)], str(tmp_path))
+    assert store.shard_path(0) == os.path.join(str(tmp_path), "user_details.txt")
+
+
+def test_records_land_in_their_hash_shard(user_store):
+    users = [make_user(n) for n in range(40)]
+    fill(user_store, users)
+
+    for shard in range(user_store.shard_count):
+        for user in user_store.read_shard(shard):
+            assert user_store.shard_for(user["mobile_phone"]) == shard
+    assert sum(len(user_store.read_shard(i)) for i in range(user_store.shard_count)) == 40
+
+
+def test_delta_log_is_replayed_on_read(user_store):
+    fill(user_store, [make_user(1), make_user(2)])
+    shard, path = _shard_of(user_store, "5550000001")
+
+    with user_store.locked("5550000001"):
+        user_store.append_delta(shard, "5550000001", {"name": "First"})
+        user_store.append_delta(shard, "5550000001", {"name": "Second", "is_active": False})
+
+    assert os.path.exists(path + ".delta")
+    user = next(u for u in user_store.read_shard(shard) if u["mobile_phone"] == "5550000001")
+    assert user["name"] == "Second"
+    assert user["is_active"] is False
+
+
+def test_delta_log_follows_key_changes(user_store):
+    fill(user_store, [make_user(1)])
+    shard, _ = _shard_of(user_store, "5550000001")
+
+    user_store.append_delta(shard, "5550000001", {"mobile_phone": "5550000099"})
+    user_store.append_delta(shard, "5550000099", {"name": "Renamed"})
+
+    (user,) = [u for u in user_store.read_shard(shard) if u["id"] == make_user(1)["id"]]
+    assert user["mobile_phone"] == "5550000099"
+    assert user["name"] == "Renamed"
+
+
+def test_nested_delta_paths(profile_store):
+    fill(profile_store, [make_profile("a", pet=False)])
+    shard, _ = _shard_of(profile_store, "a")
+
+    profile_store.append_delta(shard, "a", {"father.middle_name": "Lee"})
+    pet = {"name": "Tom", "pet_type": "cat", "breed": "Siamese", "color": "Grey"}
+    profile_store.append_delta(shard, "a", {"pet": pet})
+    profile_store.append_delta(shard, "a", {"pet.color": "White"})
+
+    (profile,) = profile_store.read_shard(shard)
+    assert profile["father"]["middle_name"] == "Lee"
+    assert profile["pet"]["color"] == "White"
+    assert profile["pet"]["breed"] == "Siamese"
+
+
+def test_rewrite_drops_delta_log(user_store):
+    fill(user_store, [make_user(1)])
+    shard, path = _shard_of(user_store, "5550000001")
+    user_store.append_delta(shard, "5550000001", {"name": "Patched"})
+
+    user_store.write_shard(shard, user_store.read_shard(shard))
+
+    assert not os.path.exists(path + ".delta")
+    assert user_store.read_shard(shard)[0]["name"] == "Patched"
+
+
+def test_stale_delta_log_is_ignored(user_store):
+    fill(user_store, [make_user(1)])
+    shard, path = _shard_of(user_store, "5550000001")
+    user_store.append_delta(shard, "5550000001", {"name": "Patched"})
+    with open(path + ".delta", "rb") as f:
+        delta_log = f.read()
+
+    # A crash between replacing the shard and removing the log leaves a log
+    # for the previous version of the file behind
+    user_store.write_shard(shard, [make_user(1, name="Rewritten")])
+    with open(path + ".delta", "wb") as f:
+        f.write(delta_log)
+
+    assert user_store.read_shard(shard)[0]["name"] == "Rewritten"
+
+    # The next append starts a fresh log for the current file
+    user_store.append_delta(shard, "5550000001", {"is_active": False})
+    user = user_store.read_shard(shard)[0]
+    assert user["name"] == "Rewritten"
+    assert user["is_active"] is False
+
+
+def test_torn_last_delta_line_is_ignored(user_store):
+    fill(user_store, [make_user(1)])
+    shard, path = _shard_of(user_store, "5550000001")
+    user_store.append_delta(shard, "5550000001", {"name": "Kept"})
+    with open(path + ".delta", "a") as f:
+        f.write('{"key": "5550000001", "set": {"name": "Lo')
+
+    assert user_store.read_shard(shard)[0]["name"] == "Kept"
+
+
+def test_apply_delta_log_checks_base_identity(tmp_path):
+    path = tmp_path / "shard.txt"
+    path.write_text("[]")
+    base_id = file_id(os.stat(path))
+    records = [{"k": "a", "v": 1}]
+    log = (json.dumps({"base": base_id}) + "\n" + json.dumps({"key": "a", "set": {"v": 2}}) + "\n").encode()
+
+    assert apply_delta_log([dict(r) for r in records], "k", log, base_id)[0]["v"] == 2
+    other_id = [base_id[0], base_id[1] + 1, base_id[2]]
+    assert apply_delta_log([dict(r) for r in records], "k", log, other_id)[0]["v"] == 1
+
+
+def test_save_changes_compacts_large_delta_logs(user_tables, user_store):
+    fill(user_store, [make_user(1)])
+    shard, path = _shard_of(user_store, "5550000001")
+    table = user_tables.table(shard)
+    row = table.find("mobile_phone", "5550000001")
+
+    compacted = False
+    for i in range(2000):
+        user = table.get(row)
+        user["name"] = f"Name {i}"
+        table.update(row, user)
+        with user_store.locked("5550000001"):
+            user_tables.save_changes(shard, "5550000001", {"name": user["name"]})
+        if not os.path.exists(path + ".delta"):
+            compacted = True
+        else:
+            assert os.path.getsize(path + ".delta") <= DELTA_COMPACTION_MIN_BYTES + 200
+
+    assert compacted
+    assert user_store.read_shard(shard)[0]["name"] == "Name 1999"
+    # A fresh reader (another worker) sees the same state
+    fresh = ShardedTables(user_store, UserTable)
+    assert fresh.find("mobile_phone", "5550000001")[0].get(0)["name"] == "Name 1999"
+
+
+def test_tables_reload_after_another_writer(user_store):
+    fill(user_store, [make_user(1)])
+    ours = ShardedTables(user_store, UserTable, routed_fields=("email",))
+    theirs = ShardedTables(user_store, UserTable, routed_fields=("email",))
+    shard, _ = _shard_of(user_store, "5550000002")
+    ours.table(shard)
+    generation = ours.generation(shard)
+
+    table = theirs.table(shard)
+    table.append(make_user(2))
+    with user_store.locked("5550000002"):
+        theirs.save(shard)
+
+    assert ours.find("email", "user2@example.com") is not None
+    assert ours.generation(shard) != generation
+
+    # Writes made through a table don't count as a reload
+    generation = ours.generation(shard)
+    with user_store.locked("5550000002"):
+        ours.save(shard)
+    assert ours.generation(shard) == generation
+
+
+def test_reload_on_another_thread_does_not_lose_a_write(user_tables, user_store, monkeypatch):
+    fill(user_store, [make_user(1)])
+    shard, _ = _shard_of(user_store, "5550000001")
+    n = next(n for n in range(2, 100) if user_store.shard_for(make_user(n)["mobile_phone"]) == shard)
+    user_tables.table(shard)
+    # The shard changes on disk (e.g. a restore), so the next read reloads it
+    user_store.write_shard(shard, user_store.read_shard(shard))
+
+    changed = threading.Event()
+    read_shard = user_store.read_shard
+
+    def slow_read_shard(i):
+        records = read_shard(i)
+        if threading.current_thread() is not threading.main_thread():
+            changed.wait(0.5)
+        return records
+
+    monkeypatch.setattr(user_store, "read_shard", slow_read_shard)
+    reader = threading.Thread(target=user_tables.table, args=(shard,))
+    reader.start()
+    time.sleep(0.05)
+
+    with user_store.locked(make_user(n)["mobile_phone"]):
+        user_tables.table(shard).append(make_user(n))
+        changed.set()
+        reader.join()
+        user_tables.save(shard)
+
+    assert len(user_store.read_shard(shard)) == 2
+
+
+def test_reshard_moves_every_record(user_store, tmp_path):
+    users = [make_user(n) for n in range(50)]
+    fill(user_store, users)
+    shard, _ = _shard_of(user_store, "5550000007")
+    user_store.append_delta(shard, "5550000007", {"name": "Pending"})
+    old_paths = user_store.shard_paths()
+    other_dir = str(tmp_path / "other")
+
+    moved = reshard(user_store, 7, [str(tmp_path), other_dir])
+
+    assert moved == 50
+    assert user_store.shard_count == 7
+    assert not any(os.path.exists(path) for path in old_paths)
+    assert os.listdir(other_dir)
+    records = [u for i in range(7) for u in user_store.read_shard(i)]
+    assert sorted(u["mobile_phone"] for u in records) == sorted(u["mobile_phone"] for u in users)
+    for i in range(7):
+        assert all(user_store.shard_for(u["mobile_phone"]) == i for u in user_store.read_shard(i))
+    assert next(u for u in records if u["mobile_phone"] == "5550000007")["name"] == "Pending"
+
+    # Other workers follow the manifest
+    follower = ShardedFileStore("user_details.txt", "mobile_phone", 4, [str(tmp_path)], str(tmp_path))
+    assert follower.shard_count == 7
+
+
+def test_reshard_to_same_layout_is_a_no_op(user_store, tmp_path):
+    fill(user_store, [make_user(1)])
+    assert reshard(user_store, 4, [str(tmp_path)]) == 0
+
+
+def test_locked_values_uses_per_value_lock_files(user_store, tmp_path):
+    with user_store.locked_values("email", "a@example.com", "b@example.com"):
+        locks = [name for name in os.listdir(tmp_path) if name.startswith("user_details.email-")]
+    assert 1 <= len(locks) <= 2
+    with user_store.locked_values("email"):
+        pass
+
+
+def test_write_routes_waiting_on_a_lock_do_not_block_the_event_loop():
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+    from app.models.user import UserCreate
+    from app.services.user_service import user_service
+    from app.utils.security import create_access_token
+
+    if user_service.get_user_by_mobile_phone("5556660000") is None:
+        user_service.create_user(UserCreate(
+            mobile_phone="5556660000", email="locks@example.com", name="Locks", password="secret"
+        ))
+    headers = {"Authorization": f"Bearer {create_access_token({'sub': '5556660000'})}"}
+
+    with TestClient(app) as client:
+        # Stands in for a reshard or restore holding every shard lock
+        with user_service.store.locked_all():
+            writer = threading.Thread(
+                target=client.put, args=("/api/v1/users/5556660000",),
+                kwargs={"json": {"name": "Late"}, "headers": headers},
+            )
+            writer.start()
+            writer.join(0.2)
+            assert writer.is_alive()
+
+            reader = threading.Thread(target=client.get, args=("/api/v1/users/me",), kwargs={"headers": headers})
+            reader.start()
+            reader.join(5)
+            assert not reader.is_alive()
+        writer.join(5)
+        assert not writer.is_alive()
+    assert user_service.get_user_by_mobile_phone("5556660000").name == "Late"